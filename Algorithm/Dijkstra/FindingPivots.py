@@ -1,13 +1,183 @@
-from collections import defaultdict, deque
-from typing import Dict, List, Tuple, Set
+from collections import deque
+from functools import lru_cache
+from itertools import repeat
+from typing import Dict, List, Tuple, Set, Optional, Union
+import math
+import numpy as np
+from csr_graph import CSRGraph, _ById, freeze_csr, uniform_weight
 
 # ---- Kiểu dữ liệu ----
 # Đồ thị có hướng, trọng số không âm
 # edges[u] = list[(v, w_uv)]
 Graph = Dict[int, List[Tuple[int, float]]]
+# Hoặc CSRGraph (csr_graph.py, dựng bằng to_csr): cung ra của đỉnh chỉ số i là
+# indices[indptr[i]:indptr[i+1]] với trọng số weights[...] tương ứng
 
-def find_pivots(
+def to_csr(edges: Graph, n: Optional[int] = None) -> CSRGraph:
+    """
+    Đổi Graph (dict) sang CSRGraph một lần, dùng lại cho mọi lần gọi find_pivots.
+      n       : nếu biết trước đỉnh là 0..n-1 thì chỉ số dày trùng luôn với id
+      còn lại : key của edges được đánh chỉ số trước, rồi tới các đỉnh chỉ xuất hiện ở đích
+    Cung ra của mỗi đỉnh giữ nguyên thứ tự trong edges[u].
+    """
+    idx: Dict[int, int] = {u: u for u in range(n)} if n is not None else {}
+    for u in edges:
+        idx.setdefault(u, len(idx))
+    for es in edges.values():
+        for v, _ in es:
+            idx.setdefault(v, len(idx))
+    ids = list(idx)
+
+    deg = np.zeros(len(ids), dtype=np.int32)
+    for u, es in edges.items():
+        deg[idx[u]] = len(es)
+    indptr = np.zeros(len(ids) + 1, dtype=np.int32)
+    np.cumsum(deg, out=indptr[1:])
+    indices = np.empty(int(indptr[-1]), dtype=np.int32)
+    weights = np.empty(int(indptr[-1]), dtype=np.float64)
+    for u, es in edges.items():
+        e = int(indptr[idx[u]])
+        for v, w_uv in es:
+            indices[e] = idx[v]
+            weights[e] = w_uv
+            e += 1
+    return CSRGraph(ids, idx, indptr, indices, weights, uniform_weight(weights))
+
+@lru_cache(maxsize=8)
+def _cached_csr(key: _ById) -> CSRGraph:
+    # Đồ thị được coi là cố định giữa các lần gọi; nếu sửa edges tại chỗ
+    # thì gọi _cached_csr.cache_clear() (hoặc truyền thẳng CSRGraph mới).
+    return freeze_csr(to_csr(key.graph))
+
+def _dhat_of(ids: List[int], d_hat: Dict[int, float], idx: np.ndarray) -> np.ndarray:
+    """d_hat của các đỉnh chỉ số idx (đỉnh không có trong d_hat -> inf, không lan được)."""
+    keys = map(ids.__getitem__, idx.tolist())
+    return np.fromiter(map(d_hat.get, keys, repeat(math.inf)), dtype=np.float64, count=len(idx))
+
+def _out_edges(indptr: np.ndarray, frontier: np.ndarray) -> np.ndarray:
+    """Chỉ số mọi cung đi ra từ các đỉnh trong frontier (mảng chỉ số đỉnh)."""
+    return _out_edges_with_src(indptr, frontier)[0]
+
+def _out_edges_with_src(indptr: np.ndarray, frontier: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Như _out_edges, kèm vị trí j trong frontier của đỉnh nguồn từng cung."""
+    starts = indptr[frontier].astype(np.int64)
+    counts = indptr[frontier + 1] - starts
+    total = int(counts.sum())
+    # cung thứ t của frontier[j] là starts[j] + t -> gom lại bằng repeat + arange
+    offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return offsets + np.arange(total, dtype=np.int64), np.repeat(np.arange(len(frontier)), counts)
+
+def _forest_subtree_sizes(
+    c_indptr: np.ndarray,
+    c_dst: np.ndarray,
+    t_src: np.ndarray,
+    t_dst: np.ndarray,
+    roots: np.ndarray,
+    n: int
+) -> np.ndarray:
+    """
+    Kích thước cây con của mọi đỉnh trong rừng F (mỗi đỉnh tối đa một cha).
+    Kahn theo từng tầng: tầng 0 là các gốc, tầng sau là con của tầng trước;
+    rồi duyệt các tầng theo thứ tự topo ngược, cộng size[v] vào size[cha(v)].
+    """
+    parent = np.full(n, -1, dtype=np.int64)
+    parent[t_dst] = t_src
+    layers = [roots]
+    while layers[-1].size:
+        layers.append(c_dst[_out_edges(c_indptr, layers[-1])])
+    size = np.ones(n, dtype=np.int64)
+    for layer in reversed(layers[1:]):
+        np.add.at(size, parent[layer], size[layer])
+    return size
+
+def _reach_count(c_indptr: np.ndarray, c_dst: np.ndarray, root: int, cap: int) -> int:
+    """Số đỉnh tới được từ root trong DAG F, dừng sớm khi đã đếm đủ cap."""
+    count = 0
+    stack = [root]
+    visited = set()
+    while stack and count < cap:
+        x = stack.pop()
+        if x in visited:
+            continue
+        visited.add(x)
+        count += 1
+        stack.extend(c_dst[c_indptr[x]:c_indptr[x + 1]].tolist())
+    return count
+
+# Với Graph (dict), bản Python thuần _find_pivots_py cũng chỉ đụng tới cung được duyệt; khi đồ thị
+# nhỏ hoặc biên đầu S có ít cung ra, chi phí cố định của các lời gọi NumPy mỗi tầng lớn hơn phần
+# tiết kiệm của bước relax vector hoá -> chạy bản Python. Việc đổi sang CSR đã được cache.
+_SMALL_GRAPH_EDGES = 1024       # số cung của cả đồ thị
+_SMALL_FRONTIER_EDGES = 256     # số cung ra của S
+
+def _find_pivots_py(
     edges: Graph,
+    d_hat: Dict[int, float],
+    S: Set[int],
+    k: int,
+    B: float
+) -> Tuple[Set[int], Set[int]]:
+    """Bản Python thuần của find_pivots cho đồ thị nhỏ (cùng kết quả)."""
+    inf = math.inf
+    dh = d_hat.get
+    out = edges.get   # chỉ đụng tới cung ra của các đỉnh được duyệt, không tiền xử lý cả đồ thị
+    empty: List = []
+
+    # --- Dòng 1-11: Relax k bước (không đổi \hat d), xây W ---
+    # Duyệt theo tầng với hai deque cur/nxt; W dùng để khử trùng lặp: đỉnh đã vào W ở tầng
+    # trước thì các cung ra của nó đã được xét rồi, không cần đưa lại vào biên (W không đổi).
+    W = set(S)
+    cur = deque(W)
+    nxt: deque = deque()
+    for _ in range(1, k + 1):  # i = 1..k
+        while cur:
+            u = cur.popleft()
+            du = dh(u, inf)
+            for v, w_uv in out(u, empty):
+                nd = du + w_uv
+                # "không làm xấu đi" ước lượng hiện tại và chưa vượt bound
+                if nd <= dh(v, inf) and nd < B and v not in W:
+                    W.add(v)
+                    nxt.append(v)
+        if not nxt:
+            break  # không lan thêm được nữa
+        cur, nxt = nxt, cur
+
+    # Nhánh nhanh: nếu |W| > k|S|, chọn luôn tất cả S làm pivots (dòng 12-13)
+    if len(W) > k * max(1, len(S)):  # tránh chia 0
+        return set(S), W
+
+    # --- Dòng 15-16: rừng F trên W bởi các cung "chặt" ---
+    children: Dict[int, List[int]] = {}
+    has_parent = set()
+    for u in W:
+        du = dh(u, inf)
+        for v, w_uv in out(u, empty):
+            if v in W and abs(du + w_uv - dh(v, inf)) < 1e-12:  # so sánh số thực
+                children.setdefault(u, []).append(v)
+                has_parent.add(v)
+
+    # Với mỗi root trong S, đếm số đỉnh tới được (dừng khi đủ k); chọn các root có >= k đỉnh
+    P = set()
+    for u in S:
+        if u in has_parent:
+            continue
+        count = 0
+        stack = [u]
+        visited = set()
+        while stack and count < k:
+            x = stack.pop()
+            if x in visited:
+                continue
+            visited.add(x)
+            count += 1
+            stack.extend(children.get(x, empty))
+        if count >= k:
+            P.add(u)
+    return P, W
+
+def find_pivots(
+    edges: Union[CSRGraph, Graph],
     d_hat: Dict[int, float],   # ước lượng hiện tại \hat d[v]
     S: Set[int],               # tập S (các "complete" vertices hiện tại)
     k: int,                    # số bước relax
@@ -18,24 +188,55 @@ def find_pivots(
 
     Giả định: Mọi đỉnh chưa hoàn tất v với d(v) < B đều có đường đi ngắn nhất đi qua
     một đỉnh đã hoàn tất trong S (giả định/điều kiện của thuật toán gốc).
+
+    Cài đặt trên CSR + mặt nạ np.bool_ cho W: mỗi tầng chỉ gom cung ra của biên Wi_1,
+    rừng F chỉ dựng từ cung ra của W -> chi phí theo số cung đụng tới, không theo N + M;
+    mọi phép kiểm tra trên các cung đó được vector hoá bằng NumPy.
+    edges có thể là Graph (dict) hoặc CSRGraph dựng sẵn bằng to_csr; Graph lớn được đổi
+    sang CSR một lần rồi cache theo id(edges) cho các lần gọi sau.
+    Graph nhỏ (< _SMALL_GRAPH_EDGES cung) hoặc S có ít cung ra (< _SMALL_FRONTIER_EDGES)
+    chạy bản Python thuần _find_pivots_py.
     """
-    # --- Dòng 1-11: Relax k bước (không đổi \hat d), xây W ---
-    W = set(S)
-    Wi_1 = set(S)
+    if isinstance(edges, CSRGraph):
+        g = edges
+    else:
+        if sum(len(edges.get(u, ())) for u in S) < _SMALL_FRONTIER_EDGES:
+            return _find_pivots_py(edges, d_hat, S, k, B)
+        g = _cached_csr(_ById(edges))
+        if len(g.indices) < _SMALL_GRAPH_EDGES:
+            return _find_pivots_py(edges, d_hat, S, k, B)
+    ids, pos, indptr, indices, w = g.ids, g.id_to_idx, g.indptr, g.indices, g.weights
+    n = len(ids)
+    # đỉnh của S không có trong đồ thị: đỉnh cô lập (không có cung ra), chỉ nằm trong W
+    extra = {u for u in S if u not in pos}
+    S_idx = np.unique(np.fromiter((pos[u] for u in S if u in pos), dtype=np.int64))
 
+    # --- Dòng 1-11: Relax k bước (không đổi \hat d), xây W ---
+    # Mỗi tầng chỉ đụng tới cung ra của biên Wi_1 (qua CSR) và \hat d của các đỉnh hai đầu,
+    # không quét toàn bộ đồ thị. W là bitmask độ dài N; các tầng được giữ lại để dựng F.
+    W_mask = np.zeros(n, dtype=np.bool_)
+    W_mask[S_idx] = True
+    Wi_1_idx, Wi_1_dhat = S_idx, _dhat_of(ids, d_hat, S_idx)
+    layers, layer_dhats = [Wi_1_idx], [Wi_1_dhat]
     for _ in range(1, k + 1):  # i = 1..k
-        Wi = set()
-        for u in Wi_1:
-            for v, w_uv in edges.get(u, []):
-                # Chỉ xét các cung "không làm xấu đi" ước lượng hiện tại
-                if d_hat[u] + w_uv <= d_hat[v]:
-                    # Chỉ quan tâm các đỉnh chưa vượt bound
-                    if d_hat[u] + w_uv < B:
-                        Wi.add(v)
-        W |= Wi
-        Wi_1 = Wi
-        if not Wi_1:
+        e, j = _out_edges_with_src(indptr, Wi_1_idx)
+        v = indices[e].astype(np.int64)
+        nd = Wi_1_dhat[j] + w[e]
+        # "không làm xấu đi" ước lượng hiện tại và chưa vượt bound (đỉnh đã ở W thì bỏ)
+        cand = (nd < B) & ~W_mask[v]     # điều kiện rẻ trước, \hat d[v] chỉ tra cho cung còn lại
+        v, nd = v[cand], nd[cand]
+        Wi_idx = np.unique(v[nd <= _dhat_of(ids, d_hat, v)])
+        W_mask[Wi_idx] = True
+        Wi_1_idx, Wi_1_dhat = Wi_idx, _dhat_of(ids, d_hat, Wi_idx)
+        if Wi_1_idx.size == 0:
             break  # không lan thêm được nữa
+        layers.append(Wi_1_idx)
+        layer_dhats.append(Wi_1_dhat)
+
+    W_idx = np.concatenate(layers)
+    order = np.argsort(W_idx, kind="stable")
+    W_idx, W_dhat = W_idx[order], np.concatenate(layer_dhats)[order]   # chỉ số (đồ thị) của W, tăng dần
+    W = {ids[i] for i in W_idx.tolist()} | extra
 
     # Nhánh nhanh: nếu |W| > k|S|, chọn luôn tất cả S làm pivots (dòng 12-13)
     if len(W) > k * max(1, len(S)):  # tránh chia 0
@@ -43,38 +244,39 @@ def find_pivots(
 
     # --- Dòng 15-16: Lập rừng có hướng F trên W bởi các cung "chặt" ---
     # F = {(u,v) in E : u,v in W and \hat d[v] = \hat d[u] + w_uv}
-    children = defaultdict(list)  # cây có hướng từ u -> v
-    indeg = defaultdict(int)
-
-    for u in W:
-        for v, w_uv in edges.get(u, []):
-            if v in W and abs(d_hat[u] + w_uv - d_hat[v]) < 1e-12:  # so sánh số thực
-                children[u].append(v)
-                indeg[v] += 1
+    # Chỉ xét cung ra của W; đỉnh được đánh lại chỉ số cục bộ 0..|W|-1 (vị trí trong W_idx).
+    e, t_src = _out_edges_with_src(indptr, W_idx)
+    v = indices[e].astype(np.int64)
+    in_W = W_mask[v]
+    e, t_src, v = e[in_W], t_src[in_W], v[in_W]
+    t_dst = np.searchsorted(W_idx, v)
+    # \hat d = inf ở hai đầu -> inf - inf = nan, so sánh cho False như abs() trong bản Python
+    with np.errstate(invalid="ignore"):
+        tight = np.abs(W_dhat[t_src] + w[e] - W_dhat[t_dst]) < 1e-12  # so sánh số thực
+    t_src, t_dst = t_src[tight], t_dst[tight]
+    m = len(W_idx)
+    indeg = np.bincount(t_dst, minlength=m)
+    # children_csr: con của u trong F là c_dst[c_indptr[u]:c_indptr[u+1]] (t_src đã tăng dần)
+    c_dst = t_dst
+    c_indptr = np.zeros(m + 1, dtype=np.int64)
+    np.cumsum(np.bincount(t_src, minlength=m), out=c_indptr[1:])
 
-    # Các "gốc" trong rừng là đỉnh có indeg == 0
-    roots = {u for u in W if indeg[u] == 0}
-
-    # Với mỗi root trong S, tính kích thước cây con; chọn các root có >= k đỉnh
-    def subtree_size(root: int) -> int:
-        # duyệt DAG/rừng: không có chu trình theo giả định (Assumption 2.1)
-        count = 0
-        stack = [root]
-        visited = set()
-        while stack:
-            x = stack.pop()
-            if x in visited:
-                continue
-            visited.add(x)
-            count += 1
-            stack.extend(children.get(x, []))
-        return count
+    roots = np.flatnonzero(indeg == 0)  # "gốc" trong rừng là đỉnh có indeg == 0
+    if indeg.max(initial=0) <= 1:
+        # F đúng là rừng (Assumption 2.1): tính kích thước MỌI cây con trong một lượt
+        size = _forest_subtree_sizes(c_indptr, c_dst, t_src, t_dst, roots, m)
+        reach_at_least_k = lambda iu: size[iu] >= k
+    else:
+        # Có đỉnh nhiều cha "chặt" (đường bằng nhau) -> F là DAG, cộng dồn sẽ đếm trùng.
+        # Khi đó đếm số đỉnh tới được từ gốc nhưng dừng ngay khi đủ k.
+        reach_at_least_k = lambda iu: _reach_count(c_indptr, c_dst, iu, k) >= k
 
-    P = set()
-    for u in S:
-        if u in roots:
-            if subtree_size(u) >= k:
-                P.add(u)
+    # Với mỗi root trong S, chọn các root có cây con >= k đỉnh
+    # (đỉnh ngoài đồ thị: gốc không có con, cây con 1 đỉnh)
+    P = {u for u in extra if k <= 1}
+    for iu in np.searchsorted(W_idx, S_idx).tolist():
+        if indeg[iu] == 0 and reach_at_least_k(iu):
+            P.add(ids[W_idx[iu]])
 
     return P, W
 
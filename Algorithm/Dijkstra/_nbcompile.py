@@ -0,0 +1,37 @@
+# _nbcompile.py
+# Biên dịch trước (AOT) các kernel Dijkstra/BFS thành module mở rộng _dijkstra_fast (.so/.pyd)
+# để lúc chạy không phải JIT (không tốn vài giây ở lần gọi đầu, không cần cài numba).
+#
+#   cd Algorithm/Dijkstra
+#   python _nbcompile.py
+#
+# csr_graph tự dùng _dijkstra_fast nếu import được và kernel_abi() khớp csr_graph.KERNEL_ABI,
+# ngược lại quay về numba JIT / Python thuần. Sửa chữ ký/kết quả kernel trong csr_kernels.py thì
+# tăng KERNEL_ABI rồi chạy lại script này (.so cũ sẽ bị bỏ qua cho tới khi build lại).
+import os
+from numba.pycc import CC
+
+from csr_graph import KERNEL_ABI
+from csr_kernels import _dijkstra_csr, _bfs_csr, _range_pairs
+
+cc = CC("_dijkstra_fast")
+cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+
+@cc.export("kernel_abi", "i8()")
+def kernel_abi():
+    return KERNEL_ABI
+
+@cc.export("dijkstra_csr", "Tuple((f8[:], i4[:]))(i4[:], i4[:], f8[:], i4, i4, b1[:], b1[:], b1)")
+def dijkstra_csr(indptr, indices, weights, start_idx, goal_idx, banned_mask, edge_mask, with_prev):
+    return _dijkstra_csr(indptr, indices, weights, start_idx, goal_idx, banned_mask, edge_mask, with_prev)
+
+@cc.export("bfs_csr", "Tuple((f8[:], i4[:]))(i4[:], i4[:], f8, i4, i4, b1[:], b1[:], b1)")
+def bfs_csr(indptr, indices, w, start_idx, goal_idx, banned_mask, edge_mask, with_prev):
+    return _bfs_csr(indptr, indices, w, start_idx, goal_idx, banned_mask, edge_mask, with_prev)
+
+@cc.export("range_pairs", "Tuple((i4[:], i4[:]))(f8[:], f8[:], f8[:], b1)")
+def range_pairs(xs, ys, rs, both):
+    return _range_pairs(xs, ys, rs, both)
+
+if __name__ == "__main__":
+    cc.compile()
@@ -0,0 +1,14 @@
+# conftest.py
+# pytest: chạy song song bằng pytest-xdist nếu có cài (giống `pytest -n auto`),
+# không có xdist thì chạy tuần tự như thường; `-n 0` để tắt. Các test độc lập với nhau
+# (setUpClass chỉ dựng dữ liệu dùng chung để đọc) nên mỗi worker tự chạy setUpClass là đủ.
+# `python -m unittest` không bị ảnh hưởng.
+import pytest
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_cmdline_main(config):
+    # chạy trước hook của xdist (nó đổi "auto" -> số worker và bật dist="load")
+    if hasattr(config, "workerinput"):   # đang ở trong worker
+        return
+    if config.pluginmanager.hasplugin("xdist") and config.getoption("numprocesses", None) is None:
+        config.option.numprocesses = "auto"
@@ -0,0 +1,429 @@
+# csr_graph.py
+from array import array
+from dataclasses import dataclass
+from functools import lru_cache
+import heapq
+from typing import Any, Dict, List, Tuple, NamedTuple, Optional, Set, Union
+import math
+import numpy as np
+
+# ======================
+# 1) ĐỒ THỊ DẠNG CSR (Compressed Sparse Row)
+# ======================
+# Thay cho adjacency dict {id: [(id, w), ...]}:
+#   - mỗi node được ánh xạ sang chỉ số nguyên 0..N-1 (id_to_idx / ids)
+#   - hàng xóm của u nằm ở indices[indptr[u]:indptr[u+1]],
+#     trọng số tương ứng ở weights[indptr[u]:indptr[u+1]]
+# => dist/prev/banned trở thành mảng phẳng đánh chỉ số theo node,
+#    không còn băm chuỗi trong vòng relax.
+
+class CSRGraph(NamedTuple):
+    ids: List[str]              # idx -> node_id
+    id_to_idx: Dict[str, int]   # node_id -> idx
+    indptr: np.ndarray          # int32[N+1]
+    indices: np.ndarray         # int32[M]
+    weights: np.ndarray         # float64[M]
+    uniform_w: Optional[float] = None  # uniform_weight(weights) tính lúc dựng đồ thị; None = chưa tính
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.ids)
+
+def csr_from_adjacency(adj: Dict[str, List[Tuple[str, float]]]) -> CSRGraph:
+    """
+    Chuyển adjacency list {node_id: [(neighbor_id, weight), ...]} sang CSRGraph.
+    Thứ tự hàng xóm của từng node được giữ nguyên.
+    """
+    ids = list(adj.keys())
+    id_to_idx = {nid: i for i, nid in enumerate(ids)}
+    nbrs = adj.values()
+    indptr = np.zeros(len(ids) + 1, dtype=np.int32)
+    np.cumsum([len(es) for es in nbrs], out=indptr[1:])
+    # gom list Python rồi đổi sang mảng một lần (ghi từng phần tử vào mảng NumPy rất chậm)
+    indices = np.array([id_to_idx[v] for es in nbrs for v, _ in es], dtype=np.int32)  # KeyError nếu hàng xóm không có trong đồ thị
+    weights = np.array([w for es in nbrs for _, w in es], dtype=np.float64)
+    return CSRGraph(ids, id_to_idx, indptr, indices, weights, uniform_weight(weights))
+
+def freeze_csr(graph: CSRGraph) -> CSRGraph:
+    """
+    Khoá ghi (flags.writeable = False) các mảng indptr/indices/weights rồi trả về chính graph.
+    Dùng cho CSRGraph được cache và chia sẻ giữa các lần gọi: ghi nhầm vào mảng sẽ báo
+    ValueError ngay thay vì âm thầm làm hỏng đồ thị của mọi nơi đang dùng chung.
+    """
+    for a in (graph.indptr, graph.indices, graph.weights):
+        a.flags.writeable = False
+    return graph
+
+class _ById:
+    """Bọc dict để làm key cho lru_cache: băm/so sánh theo id(), giữ tham chiếu để id không bị tái dùng."""
+    __slots__ = ("graph",)
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __hash__(self) -> int:
+        return id(self.graph)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, _ById) and other.graph is self.graph
+
+def as_csr(adj: Union[CSRGraph, Dict[str, List[Tuple[str, float]]]]) -> CSRGraph:
+    """
+    CSRGraph cho dijkstra: CSRGraph trả về nguyên; adjacency dict được đổi lại ở mỗi lần gọi
+    (dict có thể bị sửa tại chỗ giữa các lần gọi). Cần dùng lại đồ thị cho nhiều truy vấn thì
+    truyền thẳng CSRGraph (build_graph_csr / build_graph_cached / graph_cache).
+    """
+    if isinstance(adj, CSRGraph):
+        return adj
+    return csr_from_adjacency(adj)
+
+def csr_from_edges(
+    ids: List[str],
+    id_to_idx: Dict[str, int],
+    src: np.ndarray,
+    dst: np.ndarray,
+    weights: np.ndarray
+) -> CSRGraph:
+    """
+    Dựng CSRGraph từ danh sách cung theo chỉ số (src[e] -> dst[e], weights[e]).
+    Sắp ổn định theo src -> hàng xóm của mỗi node giữ đúng thứ tự cung được ghi,
+    giống như append lần lượt vào adjacency dict rồi gọi csr_from_adjacency.
+    """
+    src = np.asarray(src, dtype=np.int32)
+    order = np.argsort(src, kind="stable")
+    indptr = np.searchsorted(src[order], np.arange(len(ids) + 1)).astype(np.int32)
+    indices = np.asarray(dst, dtype=np.int32)[order]
+    weights = np.asarray(weights, dtype=np.float64)[order]
+    return CSRGraph(ids, id_to_idx, indptr, indices, weights, uniform_weight(weights))
+
+# Bản SoA của một tập node (dùng chung cho iot_routing_dijkstra và dijistra2): mỗi thuộc tính
+# là một mảng float64 liên tục, node thứ i là (ids[i], x[i], y[i], r[i]). Các hàm hình học
+# (range_edges) chạy trên chỉ số i; r=None (không có bán kính) được lưu thành NaN.
+@dataclass(frozen=True, eq=False)
+class NodeArray:
+    ids: np.ndarray   # object[N]
+    x: np.ndarray     # float64[N]
+    y: np.ndarray     # float64[N]
+    r: np.ndarray     # float64[N]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def node(self, i: int, node_cls: type) -> Any:
+        """Dựng lại node thứ i bằng lớp Node của module gọi (cho weight_fn khi đầu vào là NodeArray)."""
+        r = float(self.r[i])
+        return node_cls(self.ids[i], float(self.x[i]), float(self.y[i]), None if math.isnan(r) else r)
+
+    @classmethod
+    def from_xyr(cls, ids, xs, ys, rs=None) -> "NodeArray":
+        """Dựng thẳng từ các dãy id / x / y / r (cùng độ dài N), không tạo Node nào; rs=None -> toàn NaN."""
+        x = np.ascontiguousarray(xs, dtype=np.float64)
+        arr = cls(
+            ids=np.array(list(ids), dtype=object),
+            x=x,
+            y=np.ascontiguousarray(ys, dtype=np.float64),
+            r=np.full(len(x), np.nan) if rs is None else np.ascontiguousarray(rs, dtype=np.float64),
+        )
+        if not (len(arr.ids) == len(arr.x) == len(arr.y) == len(arr.r)):
+            raise ValueError("ids, xs, ys, rs phải cùng độ dài")
+        return arr
+
+def nodes_to_soa(nodes: Dict[str, Any]) -> NodeArray:
+    """Dict {id: Node} (Node bất kỳ có .x .y .r) -> NodeArray, giữ nguyên thứ tự key của dict."""
+    n = len(nodes)
+    ns = nodes.values()
+    return NodeArray(
+        ids=np.array(list(nodes.keys()), dtype=object),
+        x=np.fromiter((v.x for v in ns), dtype=np.float64, count=n),
+        y=np.fromiter((v.y for v in ns), dtype=np.float64, count=n),
+        r=np.fromiter((np.nan if v.r is None else v.r for v in ns), dtype=np.float64, count=n),
+    )
+
+# Lọc thô bằng bình phương khoảng cách: dx*dx + dy*dy <= r*r*_R2_SLACK rẻ hơn hypot nhiều,
+# chỉ cặp lọt qua mới tính d = math.hypot và so đúng d <= r như euclid/in_range. Hệ số nới (lớn
+# hơn hẳn sai số làm tròn vài ulp của d2 / r*r) để không cặp biên d == r nào bị loại oan.
+_R2_SLACK = 1.0 + 1e-9
+
+def _range_pairs_py(
+    xs: np.ndarray,
+    ys: np.ndarray,
+    rs: np.ndarray,
+    both: bool,
+    block: int = 1024
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Bản NumPy của csr_kernels._range_pairs: ma trận bình phương khoảng cách tính bằng broadcasting
+    theo từng khối `block` hàng (khối i0:i1 x cột i0:N) để bộ nhớ không vượt quá block*N.
+    Trả về các cặp ứng viên (a, b), a < b, theo hàng rồi cột.
+    """
+    n = len(xs)
+    r2 = rs * rs * _R2_SLACK
+    a_parts, b_parts = [], []
+    for i0 in range(0, n, block):
+        i1 = min(i0 + block, n)
+        dx = xs[i0:i1, None] - xs[None, i0:]
+        dy = ys[i0:i1, None] - ys[None, i0:]
+        D2 = dx * dx + dy * dy
+        if both:
+            cand = D2 <= np.minimum(r2[i0:i1, None], r2[None, i0:])
+        else:
+            cand = (D2 <= r2[i0:i1, None]) | (D2 <= r2[None, i0:])
+        a, b = np.nonzero(np.triu(cand, 1))   # theo hàng rồi cột
+        a_parts.append((a + i0).astype(np.int32))
+        b_parts.append((b + i0).astype(np.int32))
+    if not a_parts:
+        return np.empty(0, np.int32), np.empty(0, np.int32)
+    return np.concatenate(a_parts), np.concatenate(b_parts)
+
+def range_edges(
+    xs: np.ndarray,
+    ys: np.ndarray,
+    rs: np.ndarray,
+    both: bool
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Cung theo vùng phủ giữa các node (toạ độ xs/ys, bán kính rs, float64[N]):
+      both=True  : i<->j nếu d <= r_i và d <= r_j (vô hướng)
+      both=False : i->j nếu d <= r_i, j->i nếu d <= r_j (có hướng)
+    Trả về (src int32[M], dst int32[M], w float64[M]) với w = d; cặp (i, j), i < j, theo hàng
+    rồi cột, cung i->j trước j->i -> đúng thứ tự append của vòng lặp đôi cũ.
+    d = math.hypot(x_i - x_j, y_i - y_j), đúng từng bit như euclid / in_range (kể cả ca d == r).
+    r = NaN (không có bán kính) -> mọi so sánh False, không phủ được ai.
+    """
+    i, j = _kernel("range_pairs")(xs, ys, rs, both)
+    d = np.fromiter(map(math.hypot, (xs[i] - xs[j]).tolist(), (ys[i] - ys[j]).tolist()),
+                    dtype=np.float64, count=len(i))
+    fwd = d <= rs[i]   # j nằm trong vùng phủ của i
+    rev = d <= rs[j]   # i nằm trong vùng phủ của j
+    if both:
+        fwd = rev = fwd & rev
+    keep = fwd | rev   # các cặp có ít nhất một cung
+    i, j, d, fwd, rev = i[keep], j[keep], d[keep], fwd[keep], rev[keep]
+    k = np.stack([fwd, rev], axis=1).ravel()  # cung i->j rồi j->i của từng cặp
+    return (np.stack([i, j], axis=1).ravel()[k], np.stack([j, i], axis=1).ravel()[k],
+            np.repeat(d, 2)[k])
+
+def banned_mask_of(graph: CSRGraph, banned: Optional[set]) -> np.ndarray:
+    """Tập node bị cấm -> mặt nạ np.bool_ đánh chỉ số theo idx (bỏ qua id lạ)."""
+    mask = np.zeros(graph.num_nodes, dtype=np.bool_)
+    if banned:
+        for nid in banned:
+            i = graph.id_to_idx.get(nid)
+            if i is not None:
+                mask[i] = True
+    return mask
+
+def edge_mask_of(graph: CSRGraph, broken: Optional[Set[Tuple[str, str]]]) -> np.ndarray:
+    """
+    Tập cung hỏng {(u_id, v_id), ...} -> mặt nạ np.bool_[M] theo chỉ số cung (True = dùng được).
+    Chỉ duyệt hàng xóm của các u có trong `broken` (O(|broken| * bậc)), không dựng lại đồ thị.
+    """
+    mask = np.ones(len(graph.indices), dtype=np.bool_)
+    if broken:
+        for u, v in broken:
+            iu, iv = graph.id_to_idx.get(u), graph.id_to_idx.get(v)
+            if iu is None or iv is None:
+                continue
+            lo, hi = graph.indptr[iu], graph.indptr[iu + 1]
+            mask[lo + np.flatnonzero(graph.indices[lo:hi] == iv)] = False
+    return mask
+
+def check_edge_mask(edge_mask: Optional[np.ndarray], num_edges: int) -> None:
+    """edge_mask (nếu có) phải có đúng num_edges phần tử, ngược lại ValueError (chung cho bản nhanh và debug)."""
+    if edge_mask is not None and len(edge_mask) != num_edges:
+        raise ValueError(f"edge_mask phải có {num_edges} phần tử (mỗi cung một), nhận {len(edge_mask)}")
+
+def reconstruct_path(graph: CSRGraph, prev: np.ndarray, start_idx: int, goal_idx: int) -> List[str]:
+    """Đi ngược prev[] từ goal về start (prev = -1 là hết), chỉ đổi idx -> id ở bước cuối."""
+    path_idx = [goal_idx]
+    cur = goal_idx
+    while cur != start_idx:
+        cur = int(prev[cur])
+        if cur < 0:
+            return []
+        path_idx.append(cur)
+    path_idx.reverse()
+    return [graph.ids[i] for i in path_idx]
+
+# ======================
+# 2) DIJKSTRA / BFS TRÊN CSR (JIT nếu có numba, ngược lại Python thuần)
+# ======================
+
+# Phiên bản giao diện kernel (chữ ký + ngữ nghĩa của dijkstra_csr / bfs_csr / range_pairs).
+# _nbcompile.py ghi số này vào _dijkstra_fast (hàm kernel_abi()); .so build từ phiên bản khác
+# (file .so bị gitignore nên còn lại sau khi pull) bị bỏ qua thay vì gọi sai số tham số.
+# Đổi chữ ký hoặc kết quả của kernel nào thì phải tăng số này.
+KERNEL_ABI = 2
+
+@lru_cache(maxsize=None)
+def _kernel(name: str):
+    """
+    Chọn kernel `name` ("dijkstra_csr" / "bfs_csr" / "range_pairs") ở lần gọi đầu tiên, theo thứ tự:
+      1) _dijkstra_fast.<name>: module biên dịch sẵn (AOT) từ _nbcompile.py -> không cần numba lúc chạy,
+         chỉ dùng khi kernel_abi() của module khớp KERNEL_ABI
+      2) csr_kernels._<name>: JIT bằng numba (cache=True)
+      3) _<name>_py: Python thuần
+    """
+    try:
+        import _dijkstra_fast
+        if _dijkstra_fast.kernel_abi() == KERNEL_ABI:
+            return getattr(_dijkstra_fast, name)
+    except (ImportError, AttributeError):  # .so cũ: không có kernel_abi() hoặc chưa có kernel mới
+        pass
+    try:
+        import csr_kernels
+        return getattr(csr_kernels, "_" + name)
+    except ImportError:
+        return globals()["_" + name + "_py"]
+
+# Hàng đợi cho bản Python thuần: heapq trên list các số nguyên "nén" (bits(d) << shift) | node
+# thay cho tuple (d, node) -> không cấp phát tuple mỗi lần push, so sánh là một phép so int.
+# Với số thực không âm, dãy bit IEEE-754 đọc như uint64 tăng đúng theo giá trị, nên thứ tự
+# khóa nén trùng với (d, idx): cùng d thì node có chỉ số CSR nhỏ hơn ra trước (khớp kernel numba).
+# (heapq cần list, không chạy trên array.array('Q'); dùng bit chính xác thay vì nhân SCALE
+#  để không làm tròn chi phí.)
+
+def _float_bits():
+    """Trả về (buf, bits): gán buf[0] = x rồi đọc bits[0] là dãy bit của x dạng uint64."""
+    buf = array("d", [0.0])
+    return buf, memoryview(buf).cast("B").cast("Q")
+
+def _dijkstra_csr_py(
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    weights: np.ndarray,
+    start_idx: int,
+    goal_idx: int,
+    banned_mask: np.ndarray,
+    edge_mask: np.ndarray,
+    with_prev: bool
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Bản Python thuần của csr_kernels._dijkstra_csr (cùng chữ ký, cùng kết quả)."""
+    n = len(indptr) - 1
+    # dist/prev là array.array phẳng (8/4 byte mỗi node): truy cập phần tử nhanh hơn hẳn
+    # so với đánh chỉ số từng phần tử của ndarray; cuối hàm bọc lại bằng np.frombuffer (không copy)
+    dist = array("d", [math.inf]) * n
+    prev = array("i", [-1]) * (n if with_prev else 0)
+    banned = bytes(banned_mask)
+    use_edge_mask = len(edge_mask) > 0
+    ptr = indptr.tolist()
+    shift = max(1, (n - 1).bit_length())
+    low = (1 << shift) - 1
+    buf, bits = _float_bits()
+    done = bytearray(n)   # node đã pop -> các bản ghi cũ (stale) của nó bị bỏ qua
+    settled = 0
+    push, pop = heapq.heappush, heapq.heappop
+    dist[start_idx] = 0.0
+    pq = [start_idx]      # bits(0.0) == 0
+    while pq:
+        u = pop(pq) & low
+        if done[u]:
+            continue
+        done[u] = 1
+        settled += 1
+        if settled == n:
+            break   # mọi node đã chốt: phần còn lại của pq toàn bản ghi cũ, không relax được gì nữa
+        if banned[u]:
+            continue
+        d = dist[u]
+        lim = dist[goal_idx] if goal_idx >= 0 else math.inf
+        if d >= lim:
+            break   # gồm cả u == goal
+        lo, hi = ptr[u], ptr[u + 1]
+        vs, ws = indices[lo:hi], weights[lo:hi]
+        if use_edge_mask:
+            keep = edge_mask[lo:hi]
+            vs, ws = vs[keep], ws[keep]
+        for v, w in zip(vs.tolist(), ws.tolist()):
+            if banned[v]:
+                continue
+            nd = d + w
+            if nd < dist[v] and nd < lim:
+                dist[v] = nd
+                if with_prev:
+                    prev[v] = u
+                buf[0] = nd
+                push(pq, (bits[0] << shift) | v)
+    return np.frombuffer(dist, dtype=np.float64), np.frombuffer(prev, dtype=np.int32)
+
+def _bfs_csr_py(
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    w: float,
+    start_idx: int,
+    goal_idx: int,
+    banned_mask: np.ndarray,
+    edge_mask: np.ndarray,
+    with_prev: bool
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Bản Python thuần của csr_kernels._bfs_csr (mọi cung cùng trọng số w > 0)."""
+    n = len(indptr) - 1
+    dist = array("d", [math.inf]) * n
+    prev = array("i", [-1]) * (n if with_prev else 0)
+    banned = bytes(banned_mask)
+    use_edge_mask = len(edge_mask) > 0
+    ptr = indptr.tolist()
+    dist[start_idx] = 0.0
+    cur = [] if banned[start_idx] or start_idx == goal_idx else [start_idx]
+    while cur:
+        nxt = []
+        for u in cur:
+            nd = dist[u] + w
+            lo, hi = ptr[u], ptr[u + 1]
+            vs = indices[lo:hi][edge_mask[lo:hi]] if use_edge_mask else indices[lo:hi]
+            for v in vs.tolist():
+                if banned[v] or dist[v] != math.inf:
+                    continue
+                dist[v] = nd
+                if with_prev:
+                    prev[v] = u
+                if v == goal_idx:
+                    cur = nxt = []
+                    break
+                nxt.append(v)
+            if not cur:
+                break   # đã gặp goal
+        nxt.sort()   # duyệt tầng sau theo chỉ số -> hòa thì chọn giống Dijkstra dùng heap
+        cur = nxt
+    return np.frombuffer(dist, dtype=np.float64), np.frombuffer(prev, dtype=np.int32)
+
+def uniform_weight(weights: np.ndarray) -> float:
+    """Trọng số chung w > 0 (hữu hạn) nếu mọi cung bằng nhau, ngược lại 0.0."""
+    if weights.size == 0:
+        return 0.0
+    w = float(weights[0])
+    if not (0.0 < w < math.inf) or (weights != w).any():
+        return 0.0
+    return w
+
+# edge_mask mặc định: mảng rỗng = không lọc cung (kernel numba/AOT cần kiểu mảng cố định, không nhận None)
+_NO_EDGE_MASK = np.zeros(0, dtype=np.bool_)
+
+def dijkstra_csr(
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    weights: np.ndarray,
+    start_idx: int,
+    goal_idx: int,
+    banned_mask: np.ndarray,
+    with_prev: bool = True,
+    edge_mask: Optional[np.ndarray] = None,
+    uniform_w: Optional[float] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Dijkstra trên mảng CSR, trả về (dist float64[N], prev int32[N]).
+    goal_idx < 0 -> tính khoảng cách tới mọi node.
+    with_prev=False -> bỏ qua prev (mảng rỗng) khi người gọi chỉ cần chi phí.
+    edge_mask: bool[M] (xem edge_mask_of), cung e có edge_mask[e] False coi như bị hỏng.
+    Mọi cung cùng trọng số -> chạy BFS theo tầng (_bfs_csr), cùng kết quả.
+    uniform_w: uniform_weight(weights) đã tính sẵn lúc dựng đồ thị (CSRGraph.uniform_w),
+    khỏi quét lại O(M) ở mỗi truy vấn; None -> tự quét.
+    """
+    check_edge_mask(edge_mask, len(indices))
+    if edge_mask is None:
+        edge_mask = _NO_EDGE_MASK
+    w = uniform_weight(weights) if uniform_w is None else uniform_w
+    if w:
+        # mọi cung cùng trọng số (vd. đếm hop) -> BFS theo tầng, không cần heap
+        return _kernel("bfs_csr")(indptr, indices, w, start_idx, goal_idx, banned_mask, edge_mask, with_prev)
+    return _kernel("dijkstra_csr")(indptr, indices, weights, start_idx, goal_idx, banned_mask, edge_mask, with_prev)
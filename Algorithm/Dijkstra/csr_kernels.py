@@ -0,0 +1,212 @@
+# csr_kernels.py
+# Các kernel Numba cho đồ thị CSR (xem csr_graph.py).
+# Module này import numba ngay từ đầu -> chỉ được nạp lười (lazy) qua csr_graph,
+# nên máy không có numba vẫn chạy được bằng bản Python thuần.
+import numpy as np
+from numba import njit
+from csr_graph import _R2_SLACK
+
+# fastmath nhưng KHÔNG bật 'nnan'/'ninf': dist khởi tạo bằng np.inf
+# và phép so sánh nd < dist[v] phải đúng với vô cực.
+_FASTMATH = {"nsz", "arcp", "contract", "afn", "reassoc"}
+
+# ======================
+# 1) MIN-HEAP CÓ CHỈ SỐ (decrease-key)
+# ======================
+# heap[i]  : node ở vị trí i của heap (tối đa N phần tử, mỗi node xuất hiện 1 lần)
+# pos[v]   : vị trí của v trong heap, -1 nếu v không nằm trong heap
+# key[v]   : khóa của v; trong Dijkstra dùng luôn mảng dist làm key
+# -> không có bản ghi cũ (stale) nên không cần kiểm tra d != dist[u] khi pop.
+# Hai node cùng khóa được so theo chỉ số CSR, nên thứ tự pop — và đường đi chọn khi có nhiều
+# đường bằng nhau — là xác định. Chỉ số CSR là thứ tự node trong adjacency dict / nodes (không
+# phải thứ tự chuỗi id như heapq với tuple (d, node_id) của bản dict cũ): hai cách chỉ chọn
+# giống nhau khi id được thêm vào theo thứ tự tăng dần.
+
+@njit(cache=True, fastmath=_FASTMATH)
+def _iheap_less(key, a, b):
+    ka = key[a]
+    kb = key[b]
+    return ka < kb or (ka == kb and a < b)
+
+@njit(cache=True, fastmath=_FASTMATH)
+def _iheap_sift_up(heap, pos, key, i):
+    v = heap[i]
+    while i > 0:
+        parent = (i - 1) >> 1
+        pv = heap[parent]
+        if not _iheap_less(key, v, pv):
+            break
+        heap[i] = pv
+        pos[pv] = i
+        i = parent
+    heap[i] = v
+    pos[v] = i
+
+@njit(cache=True, fastmath=_FASTMATH)
+def _iheap_push_or_decrease(heap, pos, key, size, v, k):
+    """Đặt key[v] = k (k không lớn hơn key cũ); thêm v nếu chưa có. Trả về size mới."""
+    key[v] = k
+    i = pos[v]
+    if i < 0:
+        heap[size] = v
+        pos[v] = size
+        _iheap_sift_up(heap, pos, key, size)
+        return size + 1
+    _iheap_sift_up(heap, pos, key, i)
+    return size
+
+@njit(cache=True, fastmath=_FASTMATH)
+def _iheap_pop(heap, pos, key, size):
+    """Lấy node có key nhỏ nhất, trả về (v, size mới)."""
+    v_min = heap[0]
+    pos[v_min] = -1
+    size -= 1
+    if size > 0:
+        v = heap[size]
+        i = 0
+        while True:
+            child = 2 * i + 1
+            if child >= size:
+                break
+            cv = heap[child]
+            if child + 1 < size and _iheap_less(key, heap[child + 1], cv):
+                child += 1
+                cv = heap[child]
+            if not _iheap_less(key, cv, v):
+                break
+            heap[i] = cv
+            pos[cv] = i
+            i = child
+        heap[i] = v
+        pos[v] = i
+    return v_min, size
+
+# ======================
+# 2) DIJKSTRA TRÊN CSR
+# ======================
+
+@njit(cache=True, fastmath=_FASTMATH)
+def _dijkstra_csr(indptr, indices, weights, start_idx, goal_idx, banned_mask, edge_mask, with_prev):
+    """
+    Trả về (dist, prev) dạng mảng float64[N] / int32[N].
+    edge_mask: bool[M], cung e bị bỏ qua nếu edge_mask[e] False; mảng rỗng -> dùng mọi cung.
+    goal_idx < 0 -> chạy hết (single-source), ngược lại dừng khi pop được goal
+    (hoặc khi đỉnh pop ra đã không nhỏ hơn dist[goal]); dist của các đỉnh khác khi đó là tạm.
+    with_prev=False -> không ghi prev (trả về mảng rỗng) khi chỉ cần chi phí.
+    """
+    n = indptr.shape[0] - 1
+    use_edge_mask = edge_mask.shape[0] > 0
+    dist = np.full(n, np.inf)
+    prev = np.full(n if with_prev else 0, -1, dtype=np.int32)
+    heap = np.empty(n, dtype=np.int32)
+    pos = np.full(n, -1, dtype=np.int32)
+
+    dist[start_idx] = 0.0
+    size = _iheap_push_or_decrease(heap, pos, dist, 0, start_idx, 0.0)
+    while size > 0:
+        u, size = _iheap_pop(heap, pos, dist, size)
+        if banned_mask[u]:
+            continue
+        d = dist[u]
+        # cận trên: trọng số không âm -> đường nào đã >= dist[goal] thì không thể cải thiện goal
+        # (goal_idx < 0 thì không có cận)
+        lim = dist[goal_idx] if goal_idx >= 0 else np.inf
+        if d >= lim:
+            break   # gồm cả u == goal
+        for e in range(indptr[u], indptr[u + 1]):
+            if use_edge_mask and not edge_mask[e]:
+                continue
+            v = indices[e]
+            if banned_mask[v]:
+                continue
+            nd = d + weights[e]
+            # trọng số không âm -> node đã pop không bao giờ thỏa nd < dist[v] nữa;
+            # nd >= lim thì đỉnh v không nằm trên đường tốt hơn tới goal -> khỏi đẩy vào heap
+            if nd < dist[v] and nd < lim:
+                if with_prev:
+                    prev[v] = u
+                size = _iheap_push_or_decrease(heap, pos, dist, size, v, nd)
+    return dist, prev
+
+# ======================
+# 3) BFS THEO TẦNG (mọi cung cùng một trọng số w > 0)
+# ======================
+# Khi mọi cung có cùng trọng số, dist = số bước * w nên không cần heap:
+# mỗi đỉnh được chốt ngay khi gặp lần đầu. Mỗi tầng được sắp theo chỉ số trước khi duyệt,
+# nên prev (đường được chọn khi hòa) trùng với Dijkstra dùng heap (so (d, node)).
+
+@njit(cache=True)
+def _bfs_csr(indptr, indices, w, start_idx, goal_idx, banned_mask, edge_mask, with_prev):
+    """Cùng kết quả (dist, prev) với _dijkstra_csr khi mọi weights[e] == w > 0."""
+    n = indptr.shape[0] - 1
+    use_edge_mask = edge_mask.shape[0] > 0
+    dist = np.full(n, np.inf)
+    prev = np.full(n if with_prev else 0, -1, dtype=np.int32)
+    dist[start_idx] = 0.0
+    if banned_mask[start_idx] or start_idx == goal_idx:
+        return dist, prev
+    cur = np.empty(n, dtype=np.int32)
+    nxt = np.empty(n, dtype=np.int32)
+    cur[0] = start_idx
+    size = 1
+    while size > 0:
+        nsize = 0
+        for t in range(size):
+            u = cur[t]
+            nd = dist[u] + w
+            for e in range(indptr[u], indptr[u + 1]):
+                if use_edge_mask and not edge_mask[e]:
+                    continue
+                v = indices[e]
+                if banned_mask[v] or dist[v] != np.inf:
+                    continue
+                dist[v] = nd
+                if with_prev:
+                    prev[v] = u
+                if v == goal_idx:
+                    return dist, prev
+                nxt[nsize] = v
+                nsize += 1
+        nxt[:nsize].sort()
+        cur, nxt = nxt, cur
+        size = nsize
+    return dist, prev
+
+# ======================
+# 4) CUNG THEO VÙNG PHỦ (thay cho ma trận khoảng cách N x N)
+# ======================
+# Một vòng lặp đôi biên dịch: lọc thô bằng d2 = dx*dx + dy*dy so với r*r (xem
+# csr_graph._R2_SLACK) và ghi luôn các cặp ứng viên, không cần mảng tạm block x N như bản NumPy.
+# d = hypot và phép so d <= r được làm ở csr_graph.range_edges bằng math.hypot (giống euclid),
+# vì hypot của libm có thể lệch 1 ulp so với math.hypot của CPython.
+
+@njit(cache=True)
+def _range_pairs(xs, ys, rs, both):
+    """Cùng kết quả với csr_graph._range_pairs_py (xem csr_graph.range_edges)."""
+    n = xs.shape[0]
+    cap = 16
+    a = np.empty(cap, dtype=np.int32)
+    b = np.empty(cap, dtype=np.int32)
+    m = 0
+    r2 = rs * rs * _R2_SLACK
+    for i in range(n):
+        xi = xs[i]
+        yi = ys[i]
+        r2i = r2[i]
+        for j in range(i + 1, n):
+            dx = xi - xs[j]
+            dy = yi - ys[j]
+            d2 = dx * dx + dy * dy
+            if both:
+                if not (d2 <= r2i and d2 <= r2[j]):
+                    continue
+            elif not (d2 <= r2i or d2 <= r2[j]):
+                continue
+            if m == cap:
+                cap *= 2
+                a = np.concatenate((a, np.empty(cap - a.shape[0], dtype=np.int32)))
+                b = np.concatenate((b, np.empty(cap - b.shape[0], dtype=np.int32)))
+            a[m] = i
+            b[m] = j
+            m += 1
+    return a[:m].copy(), b[:m].copy()
@@ -1,7 +1,10 @@
 from dataclasses import dataclass
-from typing import Dict, List, Tuple, Optional, Set, Callable, Any
+from typing import Dict, List, Tuple, Optional, Set, Callable, Any, Union
 import heapq
 import math
+import numpy as np
+
+from csr_graph import CSRGraph, NodeArray, nodes_to_soa, as_csr, csr_from_edges, range_edges, banned_mask_of, check_edge_mask, reconstruct_path, dijkstra_csr
 
 # ======================
 # 1) MÔ HÌNH DỮ LIỆU
@@ -34,7 +37,7 @@ def in_range(src: "Node", dst: "Node") -> bool:
 # ======================
 
 def build_graph(
-    nodes: Dict[str, Node],
+    nodes: Union[Dict[str, Node], NodeArray],
     mode: str = "range",  # 'range' (như cũ) hoặc 'paths' (theo JSON cạnh)
     paths: Optional[List[Path]] = None,
     undirected: bool = False,              # nếu True và mode='paths' -> thêm cạnh ngược
@@ -53,8 +56,11 @@ def build_graph(
     mode='paths':
         - Dùng danh sách paths (một chiều). Nếu undirected=True, tự thêm cạnh ngược.
         - Trọng số = Path.length (bắt buộc có).
+
+    nodes có thể là dict {id: Node} hoặc NodeArray; bên trong luôn đổi sang NodeArray.
     """
-    ids = list(nodes.keys())
+    soa = nodes if isinstance(nodes, NodeArray) else nodes_to_soa(nodes)
+    ids = soa.ids.tolist()
     adj: Dict[str, List[Tuple[str, float]]] = {i: [] for i in ids}
 
     if mode == "paths":
@@ -62,7 +68,7 @@ def build_graph(
             raise ValueError("mode='paths' cần truyền danh sách paths")
         for p in paths:
             # đảm bảo node tồn tại
-            if p.start_id not in nodes or p.end_id not in nodes:
+            if p.start_id not in adj or p.end_id not in adj:
                 # có thể skip hoặc raise; ở đây raise để bắt lỗi dữ liệu
                 raise KeyError(f"Path {p.id} tham chiếu node không tồn tại: {p.start_id} -> {p.end_id}")
             adj[p.start_id].append((p.end_id, float(p.length)))
@@ -72,123 +78,173 @@ def build_graph(
 
     elif mode == "range":
         # giữ lại tinh thần 'both' cũ: chỉ nối vô hướng nếu hai bên phủ được nhau
-        for i in range(len(ids)):
-            for j in range(i + 1, len(ids)):
-                u, v = nodes[ids[i]], nodes[ids[j]]
-                d = euclid(u, v)
-                ok_uv = (u.r is not None and d <= u.r)
-                ok_vu = (v.r is not None and d <= v.r)
-                if ok_uv and ok_vu:
-                    # vô hướng với w là trung bình 2 chiều (nếu weight_fn bất đối xứng)
-                    w_uv = weight_fn(u, v)
-                    w_vu = weight_fn(v, u)
-                    w = 0.5 * (w_uv + w_vu)
-                    adj[u.id].append((v.id, w))
-                    adj[v.id].append((u.id, w))
+        # (r=None -> NaN: mọi phép so sánh đều False, tức là không phủ được ai)
+        # range_edges (vô hướng) trả về cung theo cặp: i->j rồi j->i, cùng trọng số d
+        src, dst, dd = range_edges(soa.x, soa.y, soa.r, True)
+        # weight_fn nhận đúng đối tượng node của người gọi khi nodes là dict (chỉ NodeArray mới dựng lại Node)
+        ns = None if isinstance(nodes, NodeArray) else list(nodes.values())
+        for i, j, d in zip(src[0::2].tolist(), dst[0::2].tolist(), dd[0::2].tolist()):
+            if weight_fn is euclid:
+                # trọng số mặc định chính là d vừa tính -> không gọi lại hypot
+                w = d
+            else:
+                u, v = (ns[i], ns[j]) if ns is not None else (soa.node(i, Node), soa.node(j, Node))
+                # vô hướng với w là trung bình 2 chiều (nếu weight_fn bất đối xứng)
+                w_uv = weight_fn(u, v)
+                w_vu = weight_fn(v, u)
+                w = 0.5 * (w_uv + w_vu)
+            adj[ids[i]].append((ids[j], w))
+            adj[ids[j]].append((ids[i], w))
         return adj
 
     else:
         raise ValueError("mode phải là 'range' hoặc 'paths'")
 
 # ======================
-# 3) DIJKSTRA giữ nguyên
+# 3) DIJKSTRA (CSR + mảng phẳng)
 # ======================
 
 def dijkstra(
-    adj: Dict[str, List[Tuple[str, float]]],
+    adj: Union[CSRGraph, Dict[str, List[Tuple[str, float]]]],
     start: str,
     goal: str,
     banned: Optional[Set[str]] = None,
-    debug: bool = False
+    debug: bool = False,
+    return_path: bool = True,
+    edge_mask: Optional[np.ndarray] = None
 ) -> Tuple[float, List[str]]:
+    """
+    Dijkstra trên đồ thị CSR (nhận cả adjacency dict, khi đó đổi sang CSR trước).
+    dist/prev là mảng phẳng theo idx, banned là mặt nạ np.bool_;
+    chỉ đổi idx -> id khi dựng lại đường đi.
+    debug=False -> chạy kernel csr_graph.dijkstra_csr (Numba nếu có);
+    debug=True  -> vòng lặp Python có in log bên dưới.
+    return_path=False -> không lưu prev, trả về (cost, []) khi chỉ cần chi phí.
+    edge_mask: bool[M] theo chỉ số cung CSR (csr_graph.edge_mask_of), False = cung hỏng.
+    Nhiều đường cùng chi phí -> chọn theo chỉ số CSR (thứ tự node trong adj), không theo chuỗi id.
+    """
+    # Các trường hợp suy biến được loại trước khi đổi sang CSR / cấp phát mảng
+    index = adj.id_to_idx if isinstance(adj, CSRGraph) else adj
     if banned is None:
         banned = set()
     if start in banned or goal in banned:
         if debug: print(f"[INIT] start/goal bị cấm → không có đường")
         return math.inf, []
-    if start not in adj or goal not in adj:
+    if start not in index or goal not in index:
         if debug: print(f"[INIT] start/goal không có trong đồ thị → không có đường")
         return math.inf, []
+    if start == goal and not debug:
+        return 0.0, ([start] if return_path else [])
+
+    graph = as_csr(adj)
 
-    dist = {u: math.inf for u in adj}
-    prev: Dict[str, Optional[str]] = {u: None for u in adj}
-    dist[start] = 0.0
-    pq = [(0.0, start)]
+    s = graph.id_to_idx[start]
+    g = graph.id_to_idx[goal]
+    ids, indptr, indices, weights = graph.ids, graph.indptr, graph.indices, graph.weights
+    banned_mask = banned_mask_of(graph, banned)
+
+    if not debug:
+        dist, prev = dijkstra_csr(indptr, indices, weights, s, g, banned_mask, return_path, edge_mask,
+                                  graph.uniform_w)
+        if dist[g] == math.inf:
+            return math.inf, []
+        return float(dist[g]), (reconstruct_path(graph, prev, s, g) if return_path else [])
+
+    check_edge_mask(edge_mask, len(indices))  # cùng lỗi với bản nhanh (dijkstra_csr)
+    dist = np.full(graph.num_nodes, np.inf, dtype=np.float64)
+    prev = np.full(graph.num_nodes if return_path else 0, -1, dtype=np.int32)
+    settled = bytearray(graph.num_nodes)
+    dist[s] = 0.0
+    pq = [(0.0, s)]
     step = 0
 
-    if debug:
-        print("===== Dijkstra Debug Start =====")
-        print(f"[INIT] start={start}, goal={goal}, banned={banned}")
+    print("===== Dijkstra Debug Start =====")
+    print(f"[INIT] start={start}, goal={goal}, banned={banned}")
 
     while pq:
         d, u = heapq.heappop(pq)
         step += 1
-        if d != dist[u] or u in banned:
-            if debug: print(f"[POP ] stale/ban -> skip: (d={d}, u={u})")
+        if settled[u] or banned_mask[u]:
+            print(f"[POP ] stale/ban -> skip: (d={d}, u={ids[u]})")
             continue
-        if u == goal:
-            if debug: print(f"[GOAL] reached {goal}")
+        settled[u] = 1
+        if u == g:
+            print(f"[GOAL] reached {goal}")
             break
-        for v, w in adj[u]:
-            if v in banned:
-                if debug: print(f"  relax {u}->{v} skip (banned)")
+        lo, hi = indptr[u], indptr[u + 1]
+        for e, v, w in zip(range(lo, hi), indices[lo:hi].tolist(), weights[lo:hi].tolist()):
+            if edge_mask is not None and not edge_mask[e]:
+                print(f"  relax {ids[u]}->{ids[v]} skip (edge masked)")
+                continue
+            if banned_mask[v]:
+                print(f"  relax {ids[u]}->{ids[v]} skip (banned)")
                 continue
             nd = d + w
             if nd < dist[v]:
                 dist[v] = nd
-                prev[v] = u
+                if return_path:
+                    prev[v] = u
                 heapq.heappush(pq, (nd, v))
-                if debug: print(f"  update {u}->{v}: dist[{v}]={nd}")
+                print(f"  update {ids[u]}->{ids[v]}: dist[{ids[v]}]={nd}")
 
-    if dist[goal] == math.inf:
-        if debug: print("[END] không có đường")
+    if dist[g] == math.inf:
+        print("[END] không có đường")
         return math.inf, []
 
-    path = []
-    cur: Optional[str] = goal
-    while cur is not None:
-        path.append(cur)
-        cur = prev[cur]
-    path.reverse()
-    if debug: print(f"[END] cost={dist[goal]}, path={path}")
-    return dist[goal], path
+    path = reconstruct_path(graph, prev, s, g) if return_path else []
+    cost = float(dist[g])
+    print(f"[END] cost={cost}, path={path}")
+    return cost, path
 
 # ======================
 # 4) HÀM TRỢ GIÚP: PARSE JSON & CHẠY
 # ======================
 
-def parse_json_to_graph(payload: Dict[str, Any], undirected: bool = False) -> Tuple[Dict[str, Node], Dict[str, List[Tuple[str, float]]]]:
+def parse_json_to_graph(payload: Dict[str, Any], undirected: bool = False) -> Tuple[Dict[str, Node], CSRGraph]:
     """
     Nhận dict JSON dạng:
     {
       "nodes": [{"node_id":1,"x":10,"y":20}, ...],
       "paths": [{"id":1,"start_id":1,"end_id":2,"length":5.0}, ...]
     }
-    -> Trả về (nodes_dict, adj) theo chế độ 'paths'.
+    -> Trả về (nodes_dict, graph) theo chế độ 'paths', graph ở dạng CSR
+       (ids/id_to_idx + indptr/indices/weights).
+
+    Dựng CSR trực tiếp trong một lượt qua "paths" (không qua List[Path] / adjacency dict):
+    cung được ghi vào ba mảng src/dst/w theo thứ tự JSON (cạnh ngược ngay sau cạnh xuôi),
+    rồi sắp ổn định theo src -> thứ tự hàng xóm giống hệt build_graph(mode='paths').
     """
-    # 1) build nodes
-    nodes_list = payload.get("nodes", [])
+    # 1) build nodes + ánh xạ id -> idx
     nodes: Dict[str, Node] = {}
-    for n in nodes_list:
+    id_to_idx: Dict[str, int] = {}
+    for n in payload.get("nodes", []):
         nid = str(n["node_id"])
         nodes[nid] = Node(id=nid, x=float(n["x"]), y=float(n["y"]), r=None)  # r không cần
+        id_to_idx.setdefault(nid, len(id_to_idx))
+    ids = list(id_to_idx)
 
-    # 2) build paths
+    # 2) paths -> mảng cung (src, dst, w)
     paths_list = payload.get("paths", [])
-    p_objs: List[Path] = []
+    step = 2 if undirected else 1
+    m = len(paths_list) * step
+    src = np.empty(m, dtype=np.int32)
+    dst = np.empty(m, dtype=np.int32)
+    w = np.empty(m, dtype=np.float64)
+    e = 0
     for p in paths_list:
-        p_objs.append(
-            Path(
-                id=str(p.get("id", "")),
-                start_id=str(p["start_id"]),
-                end_id=str(p["end_id"]),
-                length=float(p["length"])
-            )
-        )
-
-    # 3) build adj theo 'paths'
-    adj = build_graph(nodes, mode="paths", paths=p_objs, undirected=undirected)
-    return nodes, adj
+        s_id, t_id = str(p["start_id"]), str(p["end_id"])
+        su, tv = id_to_idx.get(s_id), id_to_idx.get(t_id)
+        # đảm bảo node tồn tại (raise để bắt lỗi dữ liệu, như build_graph)
+        if su is None or tv is None:
+            raise KeyError(f"Path {p.get('id', '')} tham chiếu node không tồn tại: {s_id} -> {t_id}")
+        length = float(p["length"])
+        src[e], dst[e], w[e] = su, tv, length
+        if undirected:
+            src[e + 1], dst[e + 1], w[e + 1] = tv, su, length
+        e += step
+
+    # 3) sắp theo src (ổn định) rồi tính indptr
+    return nodes, csr_from_edges(ids, id_to_idx, src, dst, w)
 
 
 if __name__ == "__main__":
@@ -39,10 +39,14 @@ import math
 # '''
 # iot_routing_dijkstra.py
 from dataclasses import dataclass
-from typing import Dict, List, Tuple, Optional, Set, Callable
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Tuple, Optional, Set, Callable, Union
 import heapq
 import math
+import numpy as np
 
+from csr_graph import CSRGraph, NodeArray, nodes_to_soa, as_csr, csr_from_edges, freeze_csr, range_edges, banned_mask_of, check_edge_mask, reconstruct_path, dijkstra_csr
 
 # 1) MÔ HÌNH NODE & HÀM CƠ BẢN
 
@@ -62,8 +66,50 @@ def in_range(src: "Node", dst: "Node") -> bool:
     return euclid(src, dst) <= src.r
 
 # 2) XÂY ĐỒ THỊ
+def _edge_list(
+    nodes: Union[Dict[str, Node], NodeArray],
+    soa: NodeArray,
+    mode: str,
+    weight_fn: Callable[[Node, Node], float]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sinh danh sách cung theo chỉ số node: cung thứ e là src[e] -> dst[e] với trọng số w[e].
+    Thứ tự cung đúng bằng thứ tự append của vòng lặp đôi cũ (cặp (i, j) theo hàng rồi cột,
+    cung i->j trước j->i) -> build_graph và build_graph_csr cho cùng thứ tự hàng xóm.
+    soa = nodes_to_soa(nodes) (hoặc chính nodes nếu là NodeArray).
+    """
+    if mode not in ("both", "either"):
+        raise ValueError("mode must be 'both' or 'either'")
+    # Điều kiện phủ sóng + khoảng cách cho mọi cặp (i, j), i < j (csr_graph.range_edges):
+    # - 'both'  : khoảng cách ≤ min(r_u, r_v) → cả hai cùng phủ tới nhau (vô hướng)
+    # - 'either': có thể xảy ra trường hợp chỉ có A→B, chứ không có B→A (có hướng)
+    src, dst, w = range_edges(soa.x, soa.y, soa.r, mode == "both")
+
+    if weight_fn is not euclid:
+        # weight_fn của người dùng là hàm Python -> gọi từng cung trên các cặp đã lọc.
+        # Đầu vào là dict -> truyền đúng đối tượng node của người gọi (giữ lớp con / thuộc tính riêng
+        # như công suất phát); chỉ NodeArray mới phải dựng lại Node.
+        if isinstance(nodes, NodeArray):
+            ns = [soa.node(i, Node) for i in range(len(soa))]
+        else:
+            ns = list(nodes.values())   # cùng thứ tự với soa (nodes_to_soa giữ thứ tự key)
+        if mode == "both":
+            """
+Ở chế độ đối xứng (both), ta giả sử liên kết giữa hai node là vô hướng (không phân biệt chiều).
+Nhưng hàm weight_fn(u,v) và weight_fn(v,u) có thể cho kết quả khác nhau (ví dụ nếu trọng số phụ thuộc vào công suất phát của từng node).
+Để “công bằng”, ta lấy trung bình của hai hướng và dùng nó làm trọng số chung cho cạnh vô hướng A—B.
+            """
+            # cung đi theo cặp (i->j, j->i) -> tính một lần cho mỗi cặp rồi nhân đôi
+            w = np.repeat(np.array([0.5 * (weight_fn(ns[u], ns[v]) + weight_fn(ns[v], ns[u]))
+                                    for u, v in zip(src[0::2].tolist(), dst[0::2].tolist())],
+                                   dtype=np.float64), 2)
+        else:
+            w = np.array([weight_fn(ns[u], ns[v]) for u, v in zip(src.tolist(), dst.tolist())],
+                         dtype=np.float64)
+    return src, dst, w
+
 def build_graph(
-    nodes: Dict[str, Node], # tất cả node, lưu trong dict {"A": Node(...), ...}
+    nodes: Union[Dict[str, Node], NodeArray], # tất cả node, dict {"A": Node(...), ...} hoặc NodeArray
     mode: str = "both",     # kiểu kết nối: đối xứng hay không đối xứng
     weight_fn: Callable[[Node, Node], float] = euclid # hàm tính trọng số (mặc định là khoảng cách Euclid)
 ) -> Dict[str, List[Tuple[str, float]]]:
@@ -79,41 +125,56 @@ def build_graph(
     }
 
     """
-    ids = list(nodes.keys())   # Bước 1: Lấy danh sách ID node
+    soa = nodes if isinstance(nodes, NodeArray) else nodes_to_soa(nodes)  # luôn làm việc trên SoA
+    ids = soa.ids.tolist()   # Bước 1: Lấy danh sách ID node
     adj: Dict[str, List[Tuple[str, float]]] = {i: [] for i in ids} # Bước 2: Tạo adjacency list rỗng
-#  Bước 3: Xét từng cặp node
-    for i in range(len(ids)):
-        for j in range(i + 1, len(ids)):
-            u, v = nodes[ids[i]], nodes[ids[j]]  #Duyệt tất cả cặp (u,v)
-            d = euclid(u, v)
-
-            if mode == "both":
-                # Điều kiện: khoảng cách ≤ min(r_u, r_v) → cả hai cùng phủ tới nhau.
-                # Thêm cạnh hai chiều A–B, B–A với trọng số w -> đồ thị lúc này sẽ vô hướng
-                if d <= min(u.r, v.r):
-                    # dùng trọng số đối xứng (trung bình 2 chiều nếu weight_fn không đối xứng)
-                    w_uv = weight_fn(u, v)  #chi phí u → v
-                    w_vu = weight_fn(v, u) # chi phí v → u  
-                    w = 0.5 * (w_uv + w_vu) # lấy trung bình 2 chiều
-                    """
-Ở chế độ đối xứng (both), ta giả sử liên kết giữa hai node là vô hướng (không phân biệt chiều).
-Nhưng hàm weight_fn(u,v) và weight_fn(v,u) có thể cho kết quả khác nhau (ví dụ nếu trọng số phụ thuộc vào công suất phát của từng node).
-Để “công bằng”, ta lấy trung bình của hai hướng và dùng nó làm trọng số chung cho cạnh vô hướng A—B.
-                    """
-                    adj[u.id].append((v.id, w))
-                    adj[v.id].append((u.id, w))
-
-# Có thể xảy ra trường hợp chỉ có A→B, chứ không có B→A. (đồ thị lúc này có hướng)
-            elif mode == "either":
-                if in_range(u, v):
-                    adj[u.id].append((v.id, weight_fn(u, v)))  # u -> v
-                if in_range(v, u):
-                    adj[v.id].append((u.id, weight_fn(v, u)))  # v -> u
-            else:
-                raise ValueError("mode must be 'both' or 'either'")
-
+    # Bước 3: Xét từng cặp node (_edge_list) rồi ghi cung vào adjacency list
+    src, dst, wts = _edge_list(nodes, soa, mode, weight_fn)
+    for i, j, w in zip(src.tolist(), dst.tolist(), wts.tolist()):
+        adj[ids[i]].append((ids[j], w))
     return adj
 
+def build_graph_csr(
+    nodes: Union[Dict[str, Node], NodeArray],
+    mode: str = "both",
+    weight_fn: Callable[[Node, Node], float] = euclid
+) -> CSRGraph:
+    """
+    Như build_graph nhưng trả thẳng CSRGraph (int32 indptr/indices, float64 weights,
+    ids / id_to_idx để đổi id <-> chỉ số), không đi qua adjacency dict.
+    Dùng cho dijkstra/reroute_*: đồ thị dựng một lần, Dijkstra chạy trên mảng.
+    """
+    soa = nodes if isinstance(nodes, NodeArray) else nodes_to_soa(nodes)
+    ids = soa.ids.tolist()
+    src, dst, wts = _edge_list(nodes, soa, mode, weight_fn)
+    return csr_from_edges(ids, {nid: i for i, nid in enumerate(ids)}, src, dst, wts)
+
+# Node là frozen dataclass (hash được) -> tuple các cặp (id, Node) là khóa theo NỘI DUNG:
+# hai dict khác nhau nhưng cùng node (vd. setUp của mỗi test) dùng chung một đồ thị.
+# NodeArray (eq=False) được băm theo định danh -> chính đối tượng đó làm khóa.
+@lru_cache(maxsize=32)
+def _build_graph_csr_by_value(
+    key: Union[Tuple[Tuple[str, Node], ...], NodeArray],
+    mode: str,
+    weight_fn: Callable[[Node, Node], float]
+) -> CSRGraph:
+    nodes = key if isinstance(key, NodeArray) else dict(key)
+    return freeze_csr(build_graph_csr(nodes, mode=mode, weight_fn=weight_fn))
+
+def build_graph_cached(
+    nodes: Union[Dict[str, Node], NodeArray],
+    mode: str = "both",
+    weight_fn: Callable[[Node, Node], float] = euclid
+) -> CSRGraph:
+    """
+    build_graph_csr có nhớ kết quả theo (các node, mode, weight_fn): lần gọi lặp lại chỉ tốn
+    O(N) để dựng khóa thay vì O(N^2) dựng lại đồ thị. CSRGraph trả về được dùng chung
+    giữa các lần gọi -> các mảng bên trong bị khoá ghi (freeze_csr), ghi vào sẽ báo ValueError.
+    NodeArray được nhớ theo chính đối tượng (không sửa các mảng x/y/r sau khi đã dựng đồ thị).
+    """
+    key = nodes if isinstance(nodes, NodeArray) else tuple(nodes.items())
+    return _build_graph_csr_by_value(key, mode, weight_fn)
+
 # 3) DIJKSTRA (đường đi chi phí nhỏ nhất)
 '''
 Nhận vào một đồ thị dạng danh sách kề adj, điểm bắt đầu start, điểm đích goal.
@@ -129,128 +190,233 @@ Trả về: (chi_phí_nhỏ_nhất, danh_sách_các_node_trên_đường_đi). N
     Khi gặp goal → dừng.
 '''
 def dijkstra(
-    adj: Dict[str, List[Tuple[str, float]]],
+    adj: Union[CSRGraph, Dict[str, List[Tuple[str, float]]]],
     start: str,
     goal: str,
     banned: Optional[Set[str]] = None,
     # tham số debug=True để in log sau mỗi lần pop và sau mỗi lần relax
-    debug: bool = True 
+    debug: bool = False,
+    # return_path=False khi chỉ cần chi phí: không lưu prev, trả về (cost, [])
+    return_path: bool = True,
+    # edge_mask: bool[M] theo chỉ số cung CSR (csr_graph.edge_mask_of), False = cung hỏng
+    edge_mask: Optional[np.ndarray] = None
+) -> Tuple[float, List[str]]:
+    """
+    Chọn bản cài đặt một lần ở đầu hàm thay vì kiểm tra `if debug:` trong từng vòng relax:
+    - debug=False: _dijkstra_fast  (CSR + kernel Numba nếu có)
+    - debug=True : _dijkstra_debug (vòng lặp Python trên cùng CSR, in log từng bước)
+    Có nhiều đường cùng chi phí thì cả hai chọn theo chỉ số CSR, tức thứ tự node trong adj
+    (node đứng trước ra khỏi heap trước), không theo thứ tự chuỗi id.
+    """
+    if debug:
+        return _dijkstra_debug(adj, start, goal, banned, return_path, edge_mask)
+    return _dijkstra_fast(adj, start, goal, banned, return_path, edge_mask)
+
+def _dijkstra_fast(
+    adj: Union[CSRGraph, Dict[str, List[Tuple[str, float]]]],
+    start: str,
+    goal: str,
+    banned: Optional[Set[str]] = None,
+    return_path: bool = True,
+    edge_mask: Optional[np.ndarray] = None
+) -> Tuple[float, List[str]]:
+    """Đổi sang CSR (nếu cần), chạy csr_graph.dijkstra_csr trên mảng, rồi dựng lại đường đi."""
+    # Các trường hợp suy biến (T8/T9/T4...) được loại trước khi đổi sang CSR / cấp phát mảng
+    index = adj.id_to_idx if isinstance(adj, CSRGraph) else adj
+    if banned is None:
+        banned = set()
+    if start in banned or goal in banned:
+        return math.inf, []
+    if start not in index or goal not in index:
+        return math.inf, []
+    if start == goal:
+        return 0.0, ([start] if return_path else [])
+
+    graph = as_csr(adj)
+
+    s = graph.id_to_idx[start]
+    g = graph.id_to_idx[goal]
+    dist, prev = dijkstra_csr(graph.indptr, graph.indices, graph.weights, s, g,
+                              banned_mask_of(graph, banned), return_path, edge_mask, graph.uniform_w)
+    if dist[g] == math.inf:
+        return math.inf, []
+    return float(dist[g]), (reconstruct_path(graph, prev, s, g) if return_path else [])
+
+def _dijkstra_debug(
+    adj: Union[CSRGraph, Dict[str, List[Tuple[str, float]]]],
+    start: str,
+    goal: str,
+    banned: Optional[Set[str]] = None,
+    return_path: bool = True,
+    edge_mask: Optional[np.ndarray] = None
 ) -> Tuple[float, List[str]]:
     '''
-dist[u]: chi phí tốt nhất đã biết hiện tại để đi từ start tới u. Khởi tạo ∞, riêng start = 0.0.
-prev[u]: nút trước đó trên đường đi tối ưu tới u (dùng để dựng lại đường).
-pq: hàng đợi ưu tiên (min-heap) chứa các cặp (khoảng_cách_tốt_nhất_tới_u, u). Luôn rút ra node có khoảng_cách nhỏ nhất hiện tại.
+Bản dễ đọc có in log sau mỗi lần pop và sau mỗi lần relax, chạy trên cùng CSR với _dijkstra_fast.
+dist[i]: chi phí tốt nhất đã biết hiện tại để đi từ start tới node chỉ số i. Khởi tạo ∞, riêng start = 0.0.
+prev[i]: chỉ số nút trước đó trên đường đi tối ưu tới i (-1 = chưa có; bỏ qua nếu return_path=False).
+pq: hàng đợi ưu tiên (min-heap) chứa các cặp (khoảng_cách_tốt_nhất_tới_u, idx_u). Luôn rút ra node có khoảng_cách nhỏ nhất hiện tại
+    (cùng khoảng cách thì chỉ số nhỏ ra trước -> chọn đường giống hệt bản nhanh).
+Log vẫn in theo node_id: chỉ đổi idx -> id lúc in.
     '''
 
+    index = adj.id_to_idx if isinstance(adj, CSRGraph) else adj
     if banned is None:
         banned = set()
     if start in banned or goal in banned:  # Nếu start hoặc goal bị cấm → không thể đi, trả về inf
         # -------------------------------
-        if debug:
-            print(f"[INIT] start/goal bị cấm → không có đường")
+        print(f"[INIT] start/goal bị cấm → không có đường")
         # -------------------------------    
         return math.inf, []
-    if start not in adj or goal not in adj: # Nếu start hoặc goal không có trong đồ thị → cũng trả về inf
+    if start not in index or goal not in index: # Nếu start hoặc goal không có trong đồ thị → cũng trả về inf
         # -------------------------------
-        if debug:
-            print(f"[INIT] start/goal không có trong đồ thị → không có đường")
+        print(f"[INIT] start/goal không có trong đồ thị → không có đường")
         # -------------------------------    
         return math.inf, []
 
-    dist = {u: math.inf for u in adj}
-    prev: Dict[str, Optional[str]] = {u: None for u in adj}
-    dist[start] = 0.0
-    pq = [(0.0, start)]
+    graph = as_csr(adj)
+    check_edge_mask(edge_mask, len(graph.indices))  # cùng lỗi với bản nhanh (dijkstra_csr)
+    ids, indptr, indices, weights = graph.ids, graph.indptr, graph.indices, graph.weights
+    n = graph.num_nodes
+    s, g = graph.id_to_idx[start], graph.id_to_idx[goal]
+    banned_mask = banned_mask_of(graph, banned)
+    dist = np.full(n, np.inf, dtype=np.float64)
+    prev = np.full(n if return_path else 0, -1, dtype=np.int32)
+    settled = bytearray(n)   # settled[u] = 1 khi u đã được pop (dist[u] đã chốt)
+    dist[s] = 0.0
+    pq = [(0.0, s)]
+    # Đổi mảng theo idx -> dict theo node_id chỉ để in log
+    show_dist = lambda: dict(zip(ids, dist.tolist()))
+    show_prev = lambda: {ids[i]: (ids[p] if p >= 0 else None) for i, p in enumerate(prev.tolist())}
+    show_pq = lambda: [(d, ids[i]) for d, i in pq]
     # -------------------------------
-    if debug:
-        print("===== Dijkstra Debug Start =====")
-        print(f"[INIT] start={start}, goal={goal}, banned={banned}")
-        print(f"[INIT] dist: {dist}")
-        print(f"[INIT] prev: {prev}")
-        print(f"[INIT] pq:   {pq}\n")
+    print("===== Dijkstra Debug Start =====")
+    print(f"[INIT] start={start}, goal={goal}, banned={banned}")
+    print(f"[INIT] dist: {show_dist()}")
+    print(f"[INIT] prev: {show_prev()}")
+    print(f"[INIT] pq:   {show_pq()}\n")
     # -------------------------------
     step = 0
     while pq:
         # Lấy ra node u có chi phí tạm nhỏ nhất d
         d, u = heapq.heappop(pq)
-        # Nếu d KHÔNG trùng với dist[u] hiện tại ⇒ bản ghi cũ (trước đó ta có tìm được đường tốt hơn tới u và đã push cái mới vào heap)
+        # Nếu u đã chốt ⇒ bản ghi cũ (trước đó ta có tìm được đường tốt hơn tới u và đã push cái mới vào heap)
         # Nếu u bị cấm ⇒ bỏ qua.
         # -------------------------------
         step += 1
-        if debug:
-            print(f"[POP  ] step={step} -> (d={d}, u={u})")
-            print(f"       current dist[{u}]={dist[u]} | banned? {u in banned}")
+        print(f"[POP  ] step={step} -> (d={d}, u={ids[u]})")
+        print(f"       current dist[{ids[u]}]={dist[u]} | banned? {bool(banned_mask[u])}")
         # -------------------------------
         # Bỏ bản ghi cũ hoặc node bị cấm
-        if d != dist[u] or u in banned:
+        if settled[u] or banned_mask[u]:
         # -------------------------------    
-            if debug:
-                reason = []
-                if d != dist[u]:
-                    reason.append("stale_entry(d != dist[u])")
-                if u in banned:
-                    reason.append("u_in_banned")
-                print(f"       -> skip ({', '.join(reason)})\n")
+            reason = []
+            if settled[u]:
+                reason.append("stale_entry(u already settled)")
+            if banned_mask[u]:
+                reason.append("u_in_banned")
+            print(f"       -> skip ({', '.join(reason)})\n")
         # -------------------------------        
             continue
+        settled[u] = 1
         #Dijkstra, lần đầu bạn pop được goal ra khỏi heap, dist[goal] đã là ngắn nhất tuyệt đối .Không cần duyệt tiếp.
-        if u == goal:
+        if u == g:
         # -------------------------------            
-            if debug:
-                print(f"       -> reached goal '{goal}', break.\n")
+            print(f"       -> reached goal '{goal}', break.\n")
         # -------------------------------        
             break
-        for v, w in adj[u]:
-            if v in banned:
+        lo, hi = indptr[u], indptr[u + 1]
+        for e, v, w in zip(range(lo, hi), indices[lo:hi].tolist(), weights[lo:hi].tolist()):
+            if edge_mask is not None and not edge_mask[e]:
+             # -------------------------------       
+                print(f"       relax {ids[u]}->{ids[v]} (w={w}): edge masked -> skip")
+            # -------------------------------            
+                continue
+            if banned_mask[v]:
              # -------------------------------       
-                if debug:
-                    print(f"       relax {u}->{v} (w={w}): v in banned -> skip")
+                print(f"       relax {ids[u]}->{ids[v]} (w={w}): v in banned -> skip")
             # -------------------------------            
                 continue
             nd = d + w           # chi phí đi qua u để tới v
             # -------------------------------  
-            if debug:
-                print(f"       relax {u}->{v} (w={w}): nd={nd} vs dist[{v}]={dist[v]}")
+            print(f"       relax {ids[u]}->{ids[v]} (w={w}): nd={nd} vs dist[{ids[v]}]={dist[v]}")
             # -------------------------------  
             if nd < dist[v]:    # nếu tốt hơn cái đang biết
                 dist[v] = nd    # cập nhật chi phí tốt nhất tới v
-                prev[v] = u     # ghi nhớ đường đi (v đến từ u)
+                if return_path:
+                    prev[v] = u # ghi nhớ đường đi (v đến từ u)
                 heapq.heappush(pq, (nd, v))  # đẩy ứng viên mới vào heap
                 # -------------------------------  
-                if debug:
-                    print(f"         -> update: dist[{v}]={nd}, prev[{v}]={u}")
-                    print(f"         -> push to pq: ({nd}, {v})")
-        if debug:
-            print(f"       dist: {dist}")
-            print(f"       prev: {prev}")
-            print(f"       pq:   {pq}\n")
-                # -------------------------------  
+                print(f"         -> update: dist[{ids[v]}]={nd}, prev[{ids[v]}]={ids[u]}")
+                print(f"         -> push to pq: ({nd}, {ids[v]})")
+        print(f"       dist: {show_dist()}")
+        print(f"       prev: {show_prev()}")
+        print(f"       pq:   {show_pq()}\n")
+            # -------------------------------  
 
-    if dist[goal] == math.inf:
+    if dist[g] == math.inf:
         # -------------------------------  
-        if debug:
-            print("[END  ] Không có đường tới goal.")
+        print("[END  ] Không có đường tới goal.")
         # -------------------------------     
         return math.inf, []
 
-    # reconstruct đường đi
-    path = []
-    cur: Optional[str] = goal
-    while cur is not None:
-        path.append(cur)
-        cur = prev[cur]
-    path.reverse()
+    cost = float(dist[g])
+    if not return_path:
+        print(f"[END  ] cost={cost} (return_path=False)")
+        return cost, []
+
+    # reconstruct đường đi: đi ngược prev[] từ goal, đổi idx -> id ở bước cuối
+    path = reconstruct_path(graph, prev, s, g)
     # -------------------------------  
-    if debug:
-        print(f"[END  ] cost={dist[goal]}, path={path}")
+    print(f"[END  ] cost={cost}, path={path}")
     # -------------------------------      
-    return dist[goal], path
-
+    return cost, path
 
 # 4)  REROUTE & KIỂM TRA NGƯỢC CHIỀU
 
+# Đồ thị không đổi khi node hỏng, chỉ tập banned thay đổi -> dựng CSR một lần rồi dùng lại,
+# node hỏng được loại bằng mặt nạ banned bên trong Dijkstra.
+class GraphCache:
+    """
+    Cache CSRGraph theo khóa (id(nodes), mode, id(weight_fn)), giữ tối đa `maxsize` đồ thị (LRU).
+    Mỗi mục giữ tham chiếu tới chính dict nodes và weight_fn, và khi trúng thì so lại bằng `is`
+    -> id của đối tượng đã bị thu hồi (rồi tái dùng cho dict / hàm khác) không trả nhầm đồ thị cũ.
+    Nếu sửa dict nodes (thêm/xoá/di chuyển node) thì phải gọi invalidate(nodes).
+    Khi trượt cache thì dựng qua build_graph_cached: dict khác nhưng cùng nội dung dùng chung CSRGraph.
+    """
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Tuple[int, str, int], Tuple[Union[Dict[str, Node], NodeArray], Callable[[Node, Node], float], CSRGraph]]" = OrderedDict()
+
+    def get(
+        self,
+        nodes: Union[Dict[str, Node], NodeArray],
+        mode: str = "both",
+        weight_fn: Callable[[Node, Node], float] = euclid
+    ) -> CSRGraph:
+        key = (id(nodes), mode, id(weight_fn))
+        hit = self._entries.get(key)
+        if hit is not None and hit[0] is nodes and hit[1] is weight_fn:
+            self._entries.move_to_end(key)
+            return hit[2]
+        graph = build_graph_cached(nodes, mode=mode, weight_fn=weight_fn)
+        self._entries[key] = (nodes, weight_fn, graph)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)   # bỏ mục lâu không dùng nhất
+        return graph
+
+    def invalidate(self, nodes: Optional[Union[Dict[str, Node], NodeArray]] = None) -> None:
+        """Bỏ mọi đồ thị đã dựng từ `nodes` (None -> xoá toàn bộ cache)."""
+        if nodes is None:
+            self._entries.clear()
+            return
+        for key in [k for k, e in self._entries.items() if e[0] is nodes]:
+            del self._entries[key]
+
+graph_cache = GraphCache()
+
 def reroute_on_failure(
-    nodes: Dict[str, Node],
+    nodes: Union[Dict[str, Node], NodeArray],
     start: str,
     goal: str,
     failed_id: str,
@@ -259,34 +425,52 @@ def reroute_on_failure(
 ) -> Tuple[float, List[str]]:
     """
     Loại node lỗi khỏi mạng rồi tìm đường thay thế tối ưu (Dijkstra).
+    Đồ thị lấy từ graph_cache; node lỗi chỉ được đánh dấu trong mặt nạ banned.
     """
-    adj = build_graph(nodes, mode=mode, weight_fn=weight_fn)
+    graph = graph_cache.get(nodes, mode=mode, weight_fn=weight_fn)
     banned = {failed_id}
-    return dijkstra(adj, start, goal, banned=banned)
+    return dijkstra(graph, start, goal, banned=banned)
 # Chặn nhiều nút hỏng
 def reroute_with_banned(
-    nodes: Dict[str, Node],
+    nodes: Union[Dict[str, Node], NodeArray],
     start: str,
     goal: str,
     banned_nodes: Set[str],
     mode: str = "both",
     weight_fn: Callable[[Node, Node], float] = euclid
 ) -> Tuple[float, List[str]]:
-    adj = build_graph(nodes, mode=mode, weight_fn=weight_fn)
-    return dijkstra(adj, start, goal, banned=banned_nodes)
+    graph = graph_cache.get(nodes, mode=mode, weight_fn=weight_fn)
+    return dijkstra(graph, start, goal, banned=banned_nodes)
 
 def has_reverse_path(
     adj_directed: Dict[str, List[Tuple[str, float]]],
     src: str,
-    dst: str
+    dst: str,
+    return_path: bool = True
 ) -> Tuple[bool, float, List[str]]:
     """
     Khi dùng 'either' (đồ thị có hướng): đã có đường src->dst,
     vậy chiều ngược dst->src có tồn tại không?
+    return_path=False khi chỉ cần biết có/không và chi phí: không dựng prev, đường đi là [].
     """
-    cost_rev, path_rev = dijkstra(adj_directed, start=dst, goal=src)
+    cost_rev, path_rev = dijkstra(adj_directed, start=dst, goal=src, return_path=return_path)
     return (cost_rev < math.inf), cost_rev, path_rev
 
+def dijkstra_pair(
+    adj: Union[CSRGraph, Dict[str, List[Tuple[str, float]]]],
+    a: str,
+    b: str,
+    banned: Optional[Set[str]] = None,
+    return_path: bool = True
+) -> Tuple[Tuple[float, List[str]], Tuple[float, List[str]]]:
+    """
+    Cả hai chiều trên đồ thị có hướng ('either'): trả về ((cost a->b, path), (cost b->a, path)).
+    Adjacency dict chỉ đổi sang CSR một lần (biến graph cục bộ) cho cả hai lượt; kết quả y hệt hai lần gọi dijkstra.
+    """
+    graph = as_csr(adj)
+    return (dijkstra(graph, a, b, banned=banned, return_path=return_path),
+            dijkstra(graph, b, a, banned=banned, return_path=return_path))
+
 # 5) DEMO NHANH
 
 if __name__ == "__main__":
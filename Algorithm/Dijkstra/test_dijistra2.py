@@ -0,0 +1,138 @@
+import contextlib
+import heapq
+import io
+import math
+import random
+import unittest
+from dataclasses import dataclass
+import dijistra2
+from dijistra2 import Node, NodeArray, build_graph
+from csr_graph import CSRGraph, as_csr, csr_from_adjacency
+# python -m unittest -v test_dijistra2
+
+def assert_close(testcase, a, b, tol=1e-9):
+    testcase.assertTrue(math.isclose(a, b, rel_tol=tol, abs_tol=tol), f"Expected {b}, got {a}")
+
+def assert_unreachable(testcase, cost, path):
+    testcase.assertEqual((cost, path), (math.inf, []))
+
+def assert_csr_equal(testcase, g, h):
+    testcase.assertEqual(g.ids, h.ids)
+    testcase.assertEqual(g.indptr.tolist(), h.indptr.tolist())
+    testcase.assertEqual(g.indices.tolist(), h.indices.tolist())
+    testcase.assertEqual(g.weights.tolist(), h.weights.tolist())
+
+# Bản tham chiếu (vòng lặp vô hướng + dict, như bản gốc trước khi có CSR / kernel) cho các test
+# so sánh đường nhanh ở D2-D3.
+def ref_build_graph_range(nodes):
+    """dijistra2.build_graph(mode='range') bản gốc: nối hai chiều khi hai node phủ được nhau."""
+    ns = list(nodes.values())
+    adj = {u.id: [] for u in ns}
+    for i in range(len(ns)):
+        for j in range(i + 1, len(ns)):
+            u, v = ns[i], ns[j]
+            d = math.hypot(u.x - v.x, u.y - v.y)
+            if u.r is not None and d <= u.r and v.r is not None and d <= v.r:
+                adj[u.id].append((v.id, d))
+                adj[v.id].append((u.id, d))
+    return adj
+
+def ref_dijkstra(adj, start, goal, banned=()):
+    """Dijkstra heapq trên adjacency dict, chỉ trả về chi phí."""
+    if start in banned or goal in banned or start not in adj or goal not in adj:
+        return math.inf
+    dist = {start: 0.0}
+    pq = [(0.0, start)]
+    while pq:
+        d, u = heapq.heappop(pq)
+        if d > dist[u]:
+            continue
+        if u == goal:
+            return d
+        for v, w in adj[u]:
+            if v not in banned and d + w < dist.get(v, math.inf):
+                dist[v] = d + w
+                heapq.heappush(pq, (d + w, v))
+    return math.inf
+
+def path_cost(adj, path):
+    """Chi phí của path theo adj (cung song song -> lấy cung rẻ nhất)."""
+    return sum(min(w for v, w in adj[u] if v == nxt) for u, nxt in zip(path, path[1:]))
+
+
+class TestDijistra2(unittest.TestCase):
+
+# weight_fn nhận đúng đối tượng node của người gọi khi nodes là dict (giữ lớp con / trường riêng);
+# chỉ NodeArray mới được dựng lại thành Node của dijistra2.
+    def test_D1_weight_fn_gets_caller_nodes(self):
+        @dataclass(frozen=True)
+        class PoweredNode(Node):
+            power: float = 1.0
+        nodes = {"A": PoweredNode("A", 0, 0, 2.0, power=2.0), "B": PoweredNode("B", 1, 0, 2.0, power=1.0)}
+        def by_power(u, v):
+            self.assertIs(u, nodes[u.id])
+            return 1.0 / u.power
+        self.assertEqual(build_graph(nodes, mode="range", weight_fn=by_power), {"A": [("B", 0.75)], "B": [("A", 0.75)]})
+        soa = NodeArray.from_xyr(["A", "B"], [0, 1], [0, 0], [2.0, 2.0])
+        self.assertEqual(build_graph(soa, mode="range", weight_fn=lambda u, v: u.r + v.r),
+                         {"A": [("B", 4.0)], "B": [("A", 4.0)]})
+        self.assertIsInstance(soa.node(0, Node), dijistra2.Node)
+
+# build_graph(mode='range') trùng bản tham chiếu; dijkstra (CSR, dict, debug) cùng chi phí
+# với Dijkstra heapq, đường trả về hợp lệ và đúng chi phí. Toạ độ nguyên để có nhiều ca d == r.
+    def test_D2_matches_reference(self):
+        rng = random.Random(2)
+        for _ in range(200):
+            n = rng.randint(1, 25)
+            nodes = {}
+            for i in range(n):
+                nid = f"n{i}"
+                r = None if rng.random() < 0.1 else rng.choice([1.0, 2.0, 5.0, rng.uniform(0, 6)])
+                nodes[nid] = dijistra2.Node(nid, float(rng.randint(0, 8)), rng.choice([0.0, rng.uniform(0, 8)]), r)
+            adj = dijistra2.build_graph(nodes, mode="range")
+            self.assertEqual(adj, ref_build_graph_range(nodes))
+            graph = as_csr(adj)
+            for _ in range(5):
+                start, goal = rng.choice(list(nodes)), rng.choice(list(nodes))
+                banned = set(rng.sample(list(nodes), rng.randint(0, n // 4)))
+                expected = ref_dijkstra(adj, start, goal, banned)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    debug = dijistra2.dijkstra(graph, start, goal, banned=banned, debug=True)
+                for cost, path in (dijistra2.dijkstra(graph, start, goal, banned=banned),
+                                   dijistra2.dijkstra(adj, start, goal, banned=banned),
+                                   debug):
+                    if expected == math.inf:
+                        assert_unreachable(self, cost, path)
+                        continue
+                    assert_close(self, cost, expected)
+                    self.assertEqual((path[0], path[-1]), (start, goal))
+                    self.assertFalse(banned & set(path))
+                    assert_close(self, path_cost(adj, path), cost)
+
+# parse_json_to_graph trả về (nodes, CSRGraph) với CSR trùng csr_from_adjacency của
+# build_graph(mode='paths') trên cùng danh sách Path (giữ thứ tự hàng xóm, cung trùng lặp).
+    def test_D3_parse_json_contract(self):
+        rng = random.Random(3)
+        for _ in range(100):
+            n = rng.randint(1, 12)
+            payload = {
+                "nodes": [{"node_id": i, "x": rng.randint(0, 9), "y": rng.randint(0, 9)} for i in range(n)],
+                "paths": [{"id": e, "start_id": rng.randrange(n), "end_id": rng.randrange(n),
+                           "length": rng.choice([1, 2.5, rng.random()])} for e in range(rng.randint(0, 3 * n))],
+            }
+            paths = [dijistra2.Path(str(p["id"]), str(p["start_id"]), str(p["end_id"]), float(p["length"]))
+                     for p in payload["paths"]]
+            for undirected in (False, True):
+                nodes, graph = dijistra2.parse_json_to_graph(payload, undirected=undirected)
+                self.assertIsInstance(graph, CSRGraph)
+                self.assertEqual(list(nodes), [str(i) for i in range(n)])
+                self.assertTrue(all(v.r is None for v in nodes.values()))
+                adj = dijistra2.build_graph(nodes, mode="paths", paths=paths, undirected=undirected)
+                assert_csr_equal(self, graph, csr_from_adjacency(adj))
+        with self.assertRaises(KeyError):
+            dijistra2.parse_json_to_graph({"nodes": [{"node_id": 1, "x": 0, "y": 0}],
+                                           "paths": [{"id": 1, "start_id": 1, "end_id": 2, "length": 1.0}]})
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
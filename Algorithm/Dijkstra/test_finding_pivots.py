@@ -0,0 +1,97 @@
+import math
+import random
+import unittest
+from collections import defaultdict
+from unittest import mock
+import FindingPivots
+# python -m unittest -v test_finding_pivots
+
+
+# Bản sao cố định của find_pivots gốc (dict, Python thuần, trước khi có CSR / vector hoá) làm chuẩn
+# so sánh: không sửa hàm này theo các bản cài đặt mới. Bản gốc cần d_hat có đủ mọi đỉnh.
+def ref_find_pivots(edges, d_hat, S, k, B):
+    W = set(S)
+    Wi_1 = set(S)
+    for _ in range(1, k + 1):
+        Wi = set()
+        for u in Wi_1:
+            for v, w_uv in edges.get(u, []):
+                if d_hat[u] + w_uv <= d_hat[v]:
+                    if d_hat[u] + w_uv < B:
+                        Wi.add(v)
+        W |= Wi
+        Wi_1 = Wi
+        if not Wi_1:
+            break
+
+    if len(W) > k * max(1, len(S)):
+        return set(S), W
+
+    children = defaultdict(list)
+    indeg = defaultdict(int)
+    for u in W:
+        for v, w_uv in edges.get(u, []):
+            if v in W and abs(d_hat[u] + w_uv - d_hat[v]) < 1e-12:
+                children[u].append(v)
+                indeg[v] += 1
+    roots = {u for u in W if indeg[u] == 0}
+
+    def subtree_size(root):
+        count = 0
+        stack = [root]
+        visited = set()
+        while stack:
+            x = stack.pop()
+            if x in visited:
+                continue
+            visited.add(x)
+            count += 1
+            stack.extend(children.get(x, []))
+        return count
+
+    P = set()
+    for u in S:
+        if u in roots:
+            if subtree_size(u) >= k:
+                P.add(u)
+    return P, W
+
+
+class TestFindingPivots(unittest.TestCase):
+
+# Mọi đường của find_pivots (Python thuần, CSRGraph, dict khi ép bỏ ngưỡng "đồ thị nhỏ") cho cùng
+# (P, W) với bản gốc: trọng số nguyên (nhiều cung chặt trùng nhau -> F là DAG), |S| = 1,
+# d_hat toàn inf, đỉnh của S không có trong đồ thị. Bản mới coi đỉnh thiếu trong d_hat là inf
+# -> được gọi với d_hat đã bỏ các mục inf, bản gốc với d_hat đầy đủ.
+    def test_F1_matches_original(self):
+        rng = random.Random(1)
+        for t in range(1000):
+            n = rng.randint(1, 30)
+            edges = {u: [(rng.randrange(n), rng.choice([1, 2, rng.random()])) for _ in range(rng.randint(0, 4))]
+                     for u in range(n) if rng.random() < 0.9}
+            if t % 5 == 0:
+                d_hat = {u: math.inf for u in range(n + 3)}
+            else:
+                d_hat = {u: rng.choice([0, 1, 2, 3, 4, math.inf]) for u in range(n + 3)}
+            sparse = {u: d for u, d in d_hat.items() if d != math.inf}
+            S = {rng.randrange(n)} if t % 3 == 0 else set(rng.sample(range(n + 3), rng.randint(1, max(1, n // 3))))
+            k, B = rng.randint(1, 4), rng.choice([3, 5, math.inf])
+            expected = ref_find_pivots(edges, d_hat, S, k, B)
+            g = FindingPivots.to_csr(edges, n if t % 2 else None)
+            for dh in (d_hat, sparse):
+                self.assertEqual(FindingPivots._find_pivots_py(edges, dh, S, k, B), expected)
+                self.assertEqual(FindingPivots.find_pivots(g, dh, S, k, B), expected)
+                with mock.patch.multiple(FindingPivots, _SMALL_GRAPH_EDGES=0, _SMALL_FRONTIER_EDGES=0):
+                    self.assertEqual(FindingPivots.find_pivots(edges, dh, S, k, B), expected)
+
+# Ví dụ trong FindingPivots.demo(): W gồm các đỉnh tới được trong k = 2 bước, chỉ 0 là pivot.
+    def test_F2_demo(self):
+        edges = {0: [(1, 1), (2, 2)], 1: [(3, 1), (4, 3)], 2: [(3, 1), (4, 2)], 3: [(5, 1)], 4: [(5, 1)], 5: []}
+        d_hat = {0: 0, 1: 1, 2: 2, 3: 2, 4: 4, 5: 3}
+        expected = ref_find_pivots(edges, d_hat, {0, 1, 2}, 2, 10.0)
+        self.assertEqual(FindingPivots.find_pivots(edges, d_hat, {0, 1, 2}, 2, 10.0), expected)
+        self.assertEqual(FindingPivots.find_pivots(FindingPivots.to_csr(edges), d_hat, {0, 1, 2}, 2, 10.0), expected)
+
+
+if __name__ == "__main__":
+    unittest.main(verbosity=2)
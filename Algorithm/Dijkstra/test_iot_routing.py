@@ -1,10 +1,37 @@
 
+import contextlib
+import io
+import logging
 import math
+import os
 import unittest
+from dataclasses import dataclass
 from iot_routing_dijkstra import (
-        Node, euclid, build_graph, dijkstra, reroute_on_failure, has_reverse_path
+        Node, NodeArray, euclid, in_range, build_graph, build_graph_csr, build_graph_cached, dijkstra, dijkstra_pair, reroute_on_failure,
+        has_reverse_path, graph_cache, GraphCache
     )
+from csr_graph import as_csr, edge_mask_of
+import dijistra2
 # python -m unittest -v test_iot_routing.TestIotRouting.test_T1_basic_both
+# Kết quả trung gian của từng test ghi qua logging (mức DEBUG), mặc định không in ra;
+# muốn xem thì chạy với LOG_LEVEL=DEBUG.
+
+log = logging.getLogger(__name__)
+if os.environ.get("LOG_LEVEL"):
+    logging.basicConfig(level=os.environ["LOG_LEVEL"].upper())
+
+def setUpModule():
+    # Làm nóng kernel (numba, cache=True) trên đồ thị tí hon: lần chạy đầu trên máy mới trả phí
+    # biên dịch ở đây thay vì trong T1, các lần sau chỉ nạp lại từ __pycache__. Không có numba thì vô hại.
+    tiny = {
+        "x": Node("x", 0.0, 0.0, 1.0),
+        "y": Node("y", 0.5, 0.0, 1.0),
+        "z": Node("z", 1.5, 0.0, 1.0),
+    }
+    # Đồ thị cache (build_graph_cached) có mảng chỉ đọc -> numba biên dịch một bản riêng.
+    for build in (build_graph_csr, build_graph_cached):
+        dijkstra(build(tiny, mode="both"), "x", "z")                                # range_edges + heap
+        dijkstra(build(tiny, mode="both", weight_fn=lambda u, v: 1.0), "x", "z")   # BFS (trọng số đều)
 
 def assert_close(testcase, a, b, tol=1e-9):
     testcase.assertTrue(math.isclose(a, b, rel_tol=tol, abs_tol=tol), f"Expected {b}, got {a}")
@@ -12,11 +39,16 @@ def assert_close(testcase, a, b, tol=1e-9):
 def assert_in(testcase, item, choices):
     testcase.assertIn(item, choices, f"Expected one of {choices}, got {item}")
 
+def assert_unreachable(testcase, cost, path):
+    testcase.assertEqual((cost, path), (math.inf, []))
+
 class TestIotRouting(unittest.TestCase):
 
-    def setUp(self):
-        # Base layout như demo (đơn vị mét)
-        self.base_nodes = {
+    @classmethod
+    def setUpClass(cls):
+        # Base layout như demo (đơn vị mét). Dựng một lần cho cả lớp: không test nào sửa
+        # base_nodes / adj_both tại chỗ (test cần bản riêng thì tự copy, xem T11/T13/T15).
+        cls.base_nodes = {
             "A": Node("A", 0, 0, 3.5),
             "B": Node("B", 2, 0, 2.0),
             "C": Node("C", 4, 0, 2.5),
@@ -24,7 +56,7 @@ class TestIotRouting(unittest.TestCase):
             "E": Node("E", 2, 2, 2.0),
             "F": Node("F", 0, 2, 2.0),
         }
-        # self.base_nodes = {
+        # cls.base_nodes = {
         #     "A": Node("A",  0.0,  0.0, 3.0),
         #     "B": Node("B", 3.0,  0.0, 3.0),
         #     "C": Node("C",-3.0,  0.0, 3.0),
@@ -32,20 +64,20 @@ class TestIotRouting(unittest.TestCase):
         #     "E": Node("E", 0.0, -3.0, 3.0),
         #     "F": Node("F", 2.0,  2.0, 3.0),
         # }
-        # self.base_nodes = {
+        # cls.base_nodes = {
         #     "A": Node("A", 0.0,   0.0, 5.0),   # phủ xa
         #     "B": Node("B", 3.0,   0.0, 2.0),   # phủ vừa
         #     "C": Node("C", 4.8,   0.0, 1.0),   # phủ ngắn
         #     "D": Node("D", 6.0,   1.5, 1.2),   # thêm 1 nút xa
         # }
-        # self.base_nodes = {
+        # cls.base_nodes = {
         #     "L1": Node("L1", 0.0, 0.0, 3.5),
         #     "L2": Node("L2", 0.0, 2.0, 3.5),
         #     "M":  Node("M",  3.0, 1.0, 3.5),   # bridge
         #     "R1": Node("R1", 6.0, 0.0, 3.5),
         #     "R2": Node("R2", 6.0, 2.0, 3.5),
         # }
-#         self.base_nodes  = {
+#         cls.base_nodes  = {
 #         "H1": Node("H1", 0.0,   0.0,   2.1),
 #         "H2": Node("H2", 2.0,   0.0,   2.1),
 #         "H3": Node("H3", 3.0,   1.732, 2.1),
@@ -53,19 +85,20 @@ class TestIotRouting(unittest.TestCase):
 #         "H5": Node("H5", 0.0,   3.464, 2.1),
 #         "H6": Node("H6",-1.0,   1.732, 2.1),
 # }
+        cls.adj_both = build_graph(cls.base_nodes, mode="both")
 
 
 # Đồ thị vô hướng, trọng số là khoảng cách Euclid.
     def test_T1_basic_both(self):
-        adj_both = build_graph(self.base_nodes, mode="both")
+        adj_both = self.adj_both
         cost, path = dijkstra(adj_both, "A", "D")
-        print("T1:", cost, path)
+        log.debug("T1: %s %s", cost, path)
         assert_close(self, cost, 6.0)
         assert_in(self, path, [["A","B","C","D"], ["A","F","E","D"]])
 # Loại node C khỏi mạng → không còn đi A-B-C-D.
     def test_T2_reroute_failed_C(self):
         cost2, path2 = reroute_on_failure(self.base_nodes, "A", "D", failed_id="C", mode="both")
-        print("T2:", cost2, path2)
+        log.debug("T2: %s %s", cost2, path2)
         assert_close(self, cost2, 6.0)
         assert_in(self, path2, [
             ["A","F","E","D"],
@@ -78,12 +111,11 @@ class TestIotRouting(unittest.TestCase):
             "B": Node("B", 3, 0, 2.0),
         }
         adj_either = build_graph(nodes_one_way, mode="either")
-        cost3, path3 = dijkstra(adj_either, "A", "B")
-        cost3b, path3b = dijkstra(adj_either, "B", "A")
-        print("T3:", cost3, path3, "| back:", cost3b, path3b)
+        (cost3, path3), (cost3b, path3b) = dijkstra_pair(adj_either, "A", "B")
+        log.debug("T3: %s %s | back: %s %s", cost3, path3, cost3b, path3b)
         assert_close(self, cost3, 3.0)
         self.assertEqual(path3, ["A","B"])
-        self.assertTrue(math.isinf(cost3b) and path3b == [])
+        assert_unreachable(self, cost3b, path3b)
 # Khoảng cách quá xa so với bán kính → đồ thị rời rạc.
     def test_T4_disconnected(self):
         nodes_disconnected = {
@@ -92,17 +124,21 @@ class TestIotRouting(unittest.TestCase):
         }
         adj_disc = build_graph(nodes_disconnected, mode="both")
         cost4, path4 = dijkstra(adj_disc, "P", "Q")
-        print("T4:", cost4, path4)
-        self.assertTrue(math.isinf(cost4) and path4 == [])
+        log.debug("T4: %s %s", cost4, path4)
+        assert_unreachable(self, cost4, path4)
 # Khi mỗi cạnh = 1.0, mục tiêu trở thành “ít hop nhất”.
     def test_T5_hop_weight(self):
-        adj_both = build_graph(self.base_nodes, mode="both")
+        adj_both = self.adj_both
         cost5, path5 = dijkstra(adj_both, "A", "D")
         adj_hop = build_graph(self.base_nodes, mode="both", weight_fn=lambda u, v: 1.0)
         cost5h, path5h = dijkstra(adj_hop, "A", "D")
-        print("T5 (euclid vs hops):", (cost5, path5), " | ", (cost5h, path5h))
+        log.debug("T5 (euclid vs hops): %s | %s", (cost5, path5), (cost5h, path5h))
         assert_close(self, cost5h, 3.0)
         assert_in(self, path5h, [["A","B","C","D"], ["A","F","E","D"]])
+        # đồ thị đếm hop được đánh dấu trọng số đều ngay lúc dựng -> dijkstra chạy BFS, cùng kết quả
+        graph_hop = build_graph_csr(self.base_nodes, mode="both", weight_fn=lambda u, v: 1.0)
+        self.assertEqual(graph_hop.uniform_w, 1.0)
+        self.assertEqual(dijkstra(graph_hop, "A", "D"), (cost5h, path5h))
 # Kiểm tra chiều ngược trong đồ thị có hướng:
     def test_T6_has_reverse_path(self):
         tri = {
@@ -112,8 +148,11 @@ class TestIotRouting(unittest.TestCase):
         }
         adj_tri = build_graph(tri, mode="either")
         ok_back, cost_back, path_back = has_reverse_path(adj_tri, src="A", dst="B")
-        print("T6:", ok_back, cost_back, path_back)
+        log.debug("T6: %s %s %s", ok_back, cost_back, path_back)
         self.assertTrue(ok_back)
+        # chỉ hỏi có/không -> cùng kết quả nhưng không dựng đường đi
+        self.assertEqual(has_reverse_path(adj_tri, src="A", dst="B", return_path=False),
+                         (ok_back, cost_back, []))
         # chấp nhận mọi đường hợp lệ B→A
         assert_in(self, path_back, [
             ["B","A"],
@@ -122,48 +161,53 @@ class TestIotRouting(unittest.TestCase):
 
 
     def test_T7_tie_paths(self):
-        adj_both = build_graph(self.base_nodes, mode="both")
+        adj_both = self.adj_both
         cost7, path7 = dijkstra(adj_both, "A", "D")
-        print("T7:", cost7, path7)
+        log.debug("T7: %s %s", cost7, path7)
         assert_close(self, cost7, 6.0)
         assert_in(self, path7, [["A","B","C","D"], ["A","F","E","D"]])
 # Trường hợp xuất phát cũng là đích.
     def test_T8_start_equals_goal(self):
-        adj_both = build_graph(self.base_nodes, mode="both")
+        adj_both = self.adj_both
         cost8, path8 = dijkstra(adj_both, "A", "A")
-        print("T8:", cost8, path8)
+        log.debug("T8: %s %s", cost8, path8)
         assert_close(self, cost8, 0.0)
         self.assertEqual(path8, ["A"])
 # Nếu start bị cấm → không thể đi đâu cả.
     def test_T9_banned_is_start(self):
-        adj_both = build_graph(self.base_nodes, mode="both")
+        adj_both = self.adj_both
         cost9, path9 = dijkstra(adj_both, "A", "D", banned={"A"})
-        print("T9:", cost9, path9)
-        self.assertTrue(math.isinf(cost9) and path9 == [])
+        log.debug("T9: %s %s", cost9, path9)
+        assert_unreachable(self, cost9, path9)
 # Khi cấm B và C, nhánh phải đi là A→F→E→D.
     def test_T10_ban_multiple_nodes(self):
-        adj_both = build_graph(self.base_nodes, mode="both")
+        adj_both = self.adj_both
         # Cấm B và C -> chỉ còn đường A-F-E-D
         banned = {"B","C"}
         cost10, path10 = dijkstra(adj_both, "A", "D", banned=banned)
-        print("T10:", cost10, path10)
+        log.debug("T10: %s %s", cost10, path10)
         assert_close(self, cost10, 6.0)
         self.assertEqual(path10, ["A","F","E","D"])
 # Mô phỏng cạnh hỏng thay vì node hỏng.
     def test_T11_broken_edges(self):
-        adj_both = build_graph(self.base_nodes, mode="both")
-        # Chặn (B,C) & (C,B) và (F,E) & (E,F) trên bản sao adj
+        graph = build_graph_csr(self.base_nodes, mode="both")
+        # Chặn (B,C) & (C,B) và (F,E) & (E,F) bằng mặt nạ cung, không sao chép đồ thị
         broken = {("B","C"), ("C","B"), ("F","E"), ("E","F")}
+        cost11, path11 = dijkstra(graph, "A", "D", edge_mask=edge_mask_of(graph, broken))
+        log.debug("T11: %s %s", cost11, path11)
+        # cùng kết quả với cách cũ: lọc cung trên bản sao adjacency dict
         pruned = {u: [(v, w) for (v, w) in nbrs if (u, v) not in broken]
-                  for u, nbrs in adj_both.items()}
-        cost11, path11 = dijkstra(pruned, "A", "D")
-        print("T11:", cost11, path11)
+                  for u, nbrs in self.adj_both.items()}
+        self.assertEqual(dijkstra(pruned, "A", "D"), (cost11, path11))
         # Đảm bảo tránh cạnh hỏng
-        edges = list(zip(path11, path11[1:]))
-        self.assertNotIn(("B","C"), edges)
-        self.assertNotIn(("C","B"), edges)
-        self.assertNotIn(("F","E"), edges)
-        self.assertNotIn(("E","F"), edges)
+        edges = set(zip(path11, path11[1:]))
+        self.assertEqual(edges & broken, set())
+        # mặt nạ sai độ dài -> ValueError ở cả bản nhanh lẫn bản debug (của cả hai module)
+        short = edge_mask_of(graph, broken)[:-1]
+        for dijkstra_fn in (dijkstra, dijistra2.dijkstra):
+            for debug in (False, True):
+                with self.assertRaises(ValueError), contextlib.redirect_stdout(io.StringIO()):
+                    dijkstra_fn(graph, "A", "D", debug=debug, edge_mask=short)
 # Tất cả node có r = 0 → không thể kết nối.
     def test_T12_zero_radius(self):
         nodes_zero_r = {
@@ -173,8 +217,127 @@ class TestIotRouting(unittest.TestCase):
         }
         adj_zero = build_graph(nodes_zero_r, mode="both")
         cost12, path12 = dijkstra(adj_zero, "X", "Z")
-        print("T12:", cost12, path12)
-        self.assertTrue(math.isinf(cost12) and path12 == [])
+        log.debug("T12: %s %s", cost12, path12)
+        assert_unreachable(self, cost12, path12)
+# Reroute dùng lại đồ thị đã cache; sửa nodes thì phải invalidate.
+    def test_T13_reroute_graph_cache(self):
+        nodes = dict(self.base_nodes)
+        cost13, path13 = reroute_on_failure(nodes, "A", "D", failed_id="C", mode="both")
+        self.assertIs(graph_cache.get(nodes, mode="both"), graph_cache.get(nodes, mode="both"))
+        del nodes["E"]  # E biến mất -> không còn đường vòng qua E
+        graph_cache.invalidate(nodes)
+        cost13b, path13b = reroute_on_failure(nodes, "A", "D", failed_id="C", mode="both")
+        log.debug("T13: %s %s | after invalidate: %s %s", cost13, path13, cost13b, path13b)
+        assert_close(self, cost13, 6.0)
+        assert_unreachable(self, cost13b, path13b)
+
+# build_graph_csr cho cùng kết quả với adjacency dict (cả 'both' lẫn 'either').
+    def test_T14_build_graph_csr(self):
+        for mode in ("both", "either"):
+            adj = build_graph(self.base_nodes, mode=mode)
+            g = build_graph_csr(self.base_nodes, mode=mode)
+            for s, t in [("A", "D"), ("D", "A"), ("B", "F")]:
+                cost_a, path_a = dijkstra(adj, s, t)
+                cost_g, path_g = dijkstra(g, s, t)
+                log.debug("T14 [%s] %s->%s: %s %s", mode, s, t, cost_g, path_g)
+                if math.isinf(cost_a):
+                    self.assertTrue(math.isinf(cost_g))
+                else:
+                    assert_close(self, cost_g, cost_a)
+                self.assertEqual(path_g, path_a)
+            self.assertEqual(g.indptr[-1], sum(len(es) for es in adj.values()))
+            # dict đổi sang CSR cho cùng mảng với build_graph_csr
+            self.assertEqual(as_csr(adj).indices.tolist(), g.indices.tolist())
+        # dict sửa tại chỗ giữa hai lần gọi: lần sau thấy đồ thị mới (không dùng CSR cũ)
+        adj = {"A": [("B", 2.0)], "B": [("C", 2.0)]}
+        self.assertEqual(dijkstra(adj, "A", "C"), (math.inf, []))
+        adj["C"] = []
+        self.assertEqual(dijkstra(adj, "A", "C"), (4.0, ["A", "B", "C"]))
+        adj["A"].append(("C", 0.5))
+        self.assertEqual(dijkstra(adj, "A", "C"), (0.5, ["A", "C"]))
+        adj["C"].append(("A", 1.0))
+        del adj["B"]
+        adj["A"].remove(("B", 2.0))
+        self.assertEqual(dijkstra(adj, "C", "A"), (1.0, ["C", "A"]))
+
+# build_graph_cached nhớ theo nội dung node: dict mới (như mỗi setUp) vẫn dùng lại đồ thị cũ.
+    def test_T15_build_graph_cached(self):
+        g1 = build_graph_cached(self.base_nodes, mode="both")
+        g2 = build_graph_cached(dict(self.base_nodes), mode="both")
+        self.assertIs(g1, g2)
+        self.assertIsNot(build_graph_cached(self.base_nodes, mode="either"), g1)
+        with self.assertRaises(ValueError):   # mảng của đồ thị dùng chung bị khoá ghi
+            g1.weights[0] = 0.0
+        moved = dict(self.base_nodes, E=Node("E", 9, 9, 2.0))  # E dời đi -> khóa khác
+        cost15, path15 = dijkstra(build_graph_cached(moved, mode="both"), "A", "D")
+        log.debug("T15: %s %s", cost15, path15)
+        assert_close(self, cost15, 6.0)
+        self.assertEqual(path15, ["A", "B", "C", "D"])
+
+# NodeArray dựng thẳng từ mảng (SoA, không có Node) cho cùng đồ thị và cùng tuyến reroute.
+    def test_T16_node_array(self):
+        ids = list(self.base_nodes)
+        soa = NodeArray.from_xyr(ids, [self.base_nodes[i].x for i in ids],
+                                 [self.base_nodes[i].y for i in ids], [self.base_nodes[i].r for i in ids])
+        self.assertEqual(dijkstra(build_graph(soa, mode="both"), "A", "D"),
+                         dijkstra(self.adj_both, "A", "D"))
+        cost16, path16 = reroute_on_failure(soa, "A", "D", failed_id="C", mode="both")
+        log.debug("T16: %s %s", cost16, path16)
+        self.assertEqual((cost16, path16),
+                         reroute_on_failure(self.base_nodes, "A", "D", failed_id="C", mode="both"))
+        self.assertIs(build_graph_cached(soa), build_graph_cached(soa))
+        with self.assertRaises(ValueError):
+            NodeArray.from_xyr(ids, [0.0], [0.0], [1.0])
+
+# GraphCache: weight_fn mới (id có thể trùng id của hàm cũ đã bị thu hồi) phải dựng đồ thị mới;
+# số mục bị chặn bởi maxsize.
+    def test_T17_graph_cache_weight_fn_and_bound(self):
+        nodes = dict(self.base_nodes)
+        for c in range(1, 51):
+            cost, path = reroute_on_failure(nodes, "A", "B", failed_id="F", weight_fn=lambda u, v, c=c: float(c))
+            self.assertEqual((cost, path), (float(c), ["A", "B"]))
+        cache = GraphCache(maxsize=4)
+        kept = [{"A": Node("A", 0, 0, 1.0)} for _ in range(10)]
+        for nodes_i in kept:
+            cache.get(nodes_i)
+        self.assertEqual(len(cache._entries), 4)
+        self.assertIs(cache.get(kept[-1]), cache.get(kept[-1]))
+
+# Ca biên d == r: build_graph phải giữ đúng cung mà in_range chấp nhận, trọng số đúng bằng euclid
+# (hypot của libm / np.hypot có thể lệch 1 ulp so với math.hypot).
+    def test_T18_radius_boundary(self):
+        a = Node("a", -3.1641368669474423, -2.214078579834874, 0.0)
+        b = Node("b", 3.072264181669537, 1.4193725649665314, 0.0)
+        r = euclid(a, b)
+        nodes = {"a": Node("a", a.x, a.y, r), "b": Node("b", b.x, b.y, r)}
+        self.assertTrue(in_range(nodes["a"], nodes["b"]))
+        for mode in ("both", "either"):
+            self.assertEqual(build_graph(nodes, mode=mode), {"a": [("b", r)], "b": [("a", r)]})
+            self.assertEqual(build_graph_csr(nodes, mode=mode).weights.tolist(), [r, r])
+
+# Hòa chi phí được phá theo chỉ số CSR (thứ tự key trong adj), không theo chuỗi id: "b" đứng trước
+# "a" nên s->b->t được chọn, ở mọi bản (kernel heap, BFS khi trọng số đều, debug, dijistra2).
+    def test_T22_ties_follow_node_order(self):
+        for w in (1.0, 2.0):
+            adj = {"s": [("a", 1.0), ("b", 1.0)], "b": [("t", w)], "a": [("t", w)], "t": []}
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = [dijkstra(adj, "s", "t"), dijkstra(adj, "s", "t", debug=True),
+                           dijistra2.dijkstra(adj, "s", "t"), dijistra2.dijkstra(adj, "s", "t", debug=True)]
+            for cost, path in results:
+                self.assertEqual((cost, path), (1.0 + w, ["s", "b", "t"]))
+
+# weight_fn nhận đúng đối tượng node của người gọi (lớp con có thêm trường, vd. công suất phát),
+# không phải Node dựng lại từ NodeArray.
+    def test_T23_weight_fn_gets_caller_nodes(self):
+        @dataclass(frozen=True)
+        class PoweredNode(Node):
+            power: float = 1.0
+        nodes = {"A": PoweredNode("A", 0, 0, 2.0, power=2.0), "B": PoweredNode("B", 1, 0, 2.0, power=1.0)}
+        def by_power(u, v):
+            self.assertIs(u, nodes[u.id])
+            return 1.0 / u.power + 1.0 / v.power
+        self.assertEqual(build_graph(nodes, mode="both", weight_fn=by_power), {"A": [("B", 1.5)], "B": [("A", 1.5)]})
+        self.assertEqual(build_graph_csr(nodes, mode="either", weight_fn=by_power).weights.tolist(), [1.5, 1.5])
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)